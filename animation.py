@@ -1,10 +1,66 @@
 import cv2
+import multiprocessing
 import numpy as np
 import os
 import random
+import threading
 
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import shared_memory
 from PIL import Image, ImageDraw, ImageFont
-from typing import List, Dict
+from typing import Iterable, List, Dict
+
+
+class KeyLocks:
+  # One lock per cache entry: threads asking for the same entry wait for a
+  # single load while different entries load in parallel.
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._locks = {}
+
+  def __call__(self, key):
+    with self._lock:
+      return self._locks.setdefault(key, threading.Lock())
+
+  def get_or_create(self, cache: Dict, key, create):
+    if key in cache:
+      return cache[key]
+    with self((id(cache), key)):
+      if key not in cache:
+        cache[key] = create()
+      return cache[key]
+
+
+class LRUCache:
+  # Bounded cache for entries that are rarely reused, least recently used
+  # first out. A miss is built outside the lock, so two threads missing the
+  # same key may both build it; the last one is kept.
+  def __init__(self, maxsize: int):
+    self.maxsize = maxsize
+    self._entries = OrderedDict()
+    self._lock = threading.Lock()
+
+  def get_or_create(self, key, create):
+    with self._lock:
+      if key in self._entries:
+        self._entries.move_to_end(key)
+        return self._entries[key]
+    value = create()
+    with self._lock:
+      self._entries[key] = value
+      self._entries.move_to_end(key)
+      while len(self._entries) > self.maxsize:
+        self._entries.popitem(last=False)
+    return value
+
+  def __len__(self):
+    return len(self._entries)
+
+
+# dialogue lines kept between scenes; a script's lines rarely repeat, so
+# they aren't kept for the life of the process like UI text
+dialogue_cache_size = 256
 
 
 class AnimCache:
@@ -12,31 +68,26 @@ class AnimCache:
     self._cache = {}
     self._img_cache = {}
     self._text_cache = {}
+    self._dialogue_cache = LRUCache(dialogue_cache_size)
     self._font_cache = {}
+    self._locks = KeyLocks()
 
   def get_font(self, font_path, font_size):
     key = hash(
       (font_path, font_size)
     )
-    if key not in self._font_cache:
-      f = ImageFont.truetype(font_path, font_size)
-      self._font_cache[key] = f
-    else:
-      f = self._font_cache[key]
-    return f
+    return self._locks.get_or_create(self._font_cache, key, lambda: ImageFont.truetype(font_path, font_size))
 
-  def get_anim_text(self, text, x=0, y=0, font_path=None, font_size=12, typewriter_effect=False, colour="#ffffff"):
+  def _text_entry(self, text, x, y, font_path, font_size, typewriter_effect, colour):
     key = hash(
       (
         text, x, y, font_path, font_size, typewriter_effect, colour
       )
     )
-    if key not in self._text_cache:
-      if font_path is not None:
-        font = self.get_font(font_path, font_size)
-      else:
-        font = None
-      a = AnimText(
+
+    def create():
+      font = self.get_font(font_path, font_size) if font_path is not None else None
+      return AnimText(
         text=text,
         font=font,
         x=x,
@@ -44,18 +95,23 @@ class AnimCache:
         typewriter_effect=typewriter_effect,
         colour=colour
       )
-      self._text_cache[key] = a
-    else:
-      a = self._text_cache[key]
-    return a
+
+    return key, create
+
+  def get_anim_text(self, text, x=0, y=0, font_path=None, font_size=12, typewriter_effect=False, colour="#ffffff"):
+    # fixed UI text such as name plates, kept for every video this process
+    # renders
+    key, create = self._text_entry(text, x, y, font_path, font_size, typewriter_effect, colour)
+    return self._locks.get_or_create(self._text_cache, key, create)
+
+  def get_dialogue_text(
+    self, text, x=0, y=0, font_path=None, font_size=12, typewriter_effect=False, colour="#ffffff"
+  ):
+    key, create = self._text_entry(text, x, y, font_path, font_size, typewriter_effect, colour)
+    return self._dialogue_cache.get_or_create(key, create)
 
   def get_image(self, path):
-    if path in self._img_cache:
-      img = self._img_cache[path]
-    else:
-      img = Image.open(path, "r")
-      self._img_cache[path] = img
-    return img
+    return self._locks.get_or_create(self._img_cache, path, lambda: Image.open(path, "r"))
 
   def get_anim_img(
     self,
@@ -70,6 +126,7 @@ class AnimCache:
     shake_effect: bool = False,
     half_speed: bool = False,
     repeat: bool = True,
+    resample: int = None,
   ):
     key = hash(
       (
@@ -78,30 +135,90 @@ class AnimCache:
         key_x_reverse,
         shake_effect,
         half_speed,
-        repeat
+        repeat,
+        resample
       )
     )
-    if key not in self._cache:
+
+    def create():
       img = self.get_image(path)
-      a = AnimImg(
-        path,
-        img,
-        x=x, y=y, w=w, h=h,
-        key_x=key_x, key_x_reverse=key_x_reverse,
-        shake_effect=shake_effect,
-        half_speed=half_speed,
-        repeat=repeat
-      )
-      self._cache[key] = a
-    else:
-      a = self._cache[key]
-    return a
+      # AnimImg seeks through the frames of the shared PIL image
+      with self._locks(("seek", path)):
+        return AnimImg(
+          path,
+          img,
+          x=x, y=y, w=w, h=h,
+          key_x=key_x, key_x_reverse=key_x_reverse,
+          shake_effect=shake_effect,
+          half_speed=half_speed,
+          repeat=repeat,
+          resample=resample
+        )
+
+    return self._locks.get_or_create(self._cache, key, create)
 
 
 anim_cache = AnimCache()
 
 
-class AnimImg:
+class Frozen:
+  # anim_cache hands the same objects to every scene, video and thread, so
+  # they can't be modified once built; per-scene settings go in a Layer
+  _frozen = False
+
+  def __setattr__(self, name, value):
+    if self._frozen:
+      raise AttributeError(f"{type(self).__name__} objects are shared through anim_cache and are read-only")
+    super().__setattr__(name, value)
+
+
+class PaletteFrame(Frozen):
+  # A sprite frame kept as uint8 palette indices, cropped to its visible
+  # pixels, in a "P" image carrying the sprite's shared RGBA palette. It is
+  # only expanded to RGBA inside blit.
+  def __init__(self, indices: Image, offset, size):
+    self.indices = indices
+    self.offset = offset
+    self.size = size
+    self._frozen = True
+
+  def blit(self, background: Image, xy):
+    if self.indices is None:
+      return
+    rgba = self.indices.convert("RGBA")
+    background.paste(rgba, (xy[0] + self.offset[0], xy[1] + self.offset[1]), mask=rgba)
+
+
+def compact_frames(frames: List[Image]):
+  # Sprites are 256-colour GIFs with 1-bit transparency, so their RGBA frames
+  # usually fit one palette. Fully transparent pixels are all treated as the
+  # same colour since pasting through a zero alpha never shows them. Returns
+  # None when the frames need more than 256 colours.
+  pixels = []
+  for frame in frames:
+    rgba = np.array(frame, dtype=np.uint8)
+    rgba[rgba[:, :, 3] == 0] = 0
+    pixels.append(rgba.view(np.uint32)[:, :, 0])
+  palette = np.unique(np.concatenate([p.ravel() for p in pixels]))
+  if len(palette) > 256:
+    return None
+  palette_bytes = palette.view(np.uint8).tobytes()
+  compact = []
+  for frame, p in zip(frames, pixels):
+    visible = p != 0
+    if not visible.any():
+      compact.append(PaletteFrame(None, (0, 0), frame.size))
+      continue
+    rows = np.flatnonzero(visible.any(axis=1))
+    cols = np.flatnonzero(visible.any(axis=0))
+    crop = p[rows[0]:rows[-1] + 1, cols[0]:cols[-1] + 1]
+    indices = Image.fromarray(np.searchsorted(palette, crop).astype(np.uint8), "P")
+    indices.putpalette(palette_bytes, "RGBA")
+    compact.append(PaletteFrame(indices, (int(cols[0]), int(rows[0])), frame.size))
+  return compact
+
+
+class AnimImg(Frozen):
   def __init__(
     self,
     path: str,
@@ -116,74 +233,93 @@ class AnimImg:
     shake_effect: bool = False,
     half_speed: bool = False,
     repeat: bool = True,
+    resample: int = None,
   ):
     self.x = x
     self.y = y
     self.path = path
+    self.resample = resample
     self.key_x = key_x
     self.key_x_reverse = key_x_reverse
-    img = img
+    offsets = None
     if img.format == "GIF" and img.is_animated:
       self.frames = []
       for idx in range(img.n_frames):
         img.seek(idx)
         self.frames.append(self.resize(img, w=w, h=h).convert("RGBA"))
-    elif key_x is not None:
-      self.frames = []
-      for x_pad in range(key_x):
-        self.frames.append(
-          add_margin(
-            self.resize(img, w=w, h=h).convert("RGBA"), 0, 0, 0, x_pad
-          )
-        )
-      if key_x_reverse:
-        for x_pad in reversed(range(key_x)):
-          self.frames.append(
-            add_margin(
-              self.resize(img, w=w, h=h).convert("RGBA"), 0, 0, 0, x_pad
-            )
-          )
     else:
       self.frames = [self.resize(img, w=w, h=h).convert("RGBA")]
+      if key_x is not None:
+        # the bobbing arrow is a single frame slid right by up to key_x pixels
+        # and back, applied as a paste offset rather than padded copies
+        offsets = list(range(key_x))
+        if key_x_reverse:
+          offsets += list(reversed(range(key_x)))
+    if offsets is None:
+      offsets = [0] * len(self.frames)
+      frame_indices = list(range(len(self.frames)))
+    else:
+      frame_indices = [0] * len(offsets)
+    # Per-step (frame index, x offset) tables. loop_track is indexed by
+    # frame % length when the animation repeats (half_speed plays each of the
+    # first half of the frames twice), hold_track by min(frame, length - 1).
+    self.hold_track = list(zip(frame_indices, offsets))
+    if half_speed:
+      self.loop_track = [(frame_indices[i // 2], offsets[i // 2]) for i in range(len(offsets))]
+    else:
+      self.loop_track = self.hold_track
     self.w = self.frames[0].size[0]
     self.h = self.frames[0].size[1]
+    # GIF sprites are kept palette-indexed at a quarter of the memory;
+    # anything with more colours (smoothly resized frames) stays RGBA
+    compact = compact_frames(self.frames) if img.format == "GIF" else None
+    if compact is not None:
+      self.frames = compact
     self.shake_effect = shake_effect
     self.half_speed = half_speed
     self.repeat = repeat
+    self._frozen = True
 
   def resize(self, frame, *, w: int = None, h: int = None):
     if w is not None and h is not None:
+      if self.resample is not None:
+        return frame.resize((w, h), self.resample)
       return frame.resize((w, h))
     else:
       if w is not None:
         w_perc = w / float(frame.size[0])
         _h = int((float(frame.size[1]) * float(w_perc)))
-        return frame.resize((w, _h), Image.ANTIALIAS)
+        return frame.resize((w, _h), Image.LANCZOS if self.resample is None else self.resample)
       if h is not None:
         h_perc = h / float(frame.size[1])
         _w = int((float(frame.size[0]) * float(h_perc)))
-        return frame.resize((_w, h), Image.ANTIALIAS)
+        return frame.resize((_w, h), Image.LANCZOS if self.resample is None else self.resample)
     return frame
 
-  def render(self, background: Image = None, frame: int = 0):
-    if frame > len(self.frames) - 1:
-      if self.repeat:
-        frame = frame % len(self.frames)
-      else:
-        frame = len(self.frames) - 1
-    if self.half_speed and self.repeat:
-      frame = int(frame / 2)
-    _img = self.frames[frame]
+  def render(
+    self, background: Image = None, frame: int = 0, *, repeat: bool = None, y: int = None, shake_offset=None
+  ):
+    # repeat and y override the object's own settings for one draw; a
+    # shake_offset is used instead of a random jitter when shaking
+    repeat = self.repeat if repeat is None else repeat
+    if repeat:
+      frame_idx, x_offset = self.loop_track[frame % len(self.loop_track)]
+    else:
+      frame_idx, x_offset = self.hold_track[min(frame, len(self.hold_track) - 1)]
+    _img = self.frames[frame_idx]
     if background is None:
-      _w, _h = _img.size
-      _background = Image.new("RGBA", (_w, _h), (255, 255, 255, 255))
+      _background = Image.new("RGBA", (self.w, self.h), (255, 255, 255, 255))
     else:
       _background = background
-    bg_w, bg_h = _background.size
-    offset = (self.x, self.y)
-    if self.shake_effect:
-      offset = (self.x + random.randint(-1, 1), self.y + random.randint(-1, 1))
-    _background.paste(_img, offset, mask=_img)
+    offset = (self.x + x_offset, self.y if y is None else y)
+    if shake_offset is None and self.shake_effect:
+      shake_offset = (random.randint(-1, 1), random.randint(-1, 1))
+    if shake_offset is not None:
+      offset = (offset[0] + shake_offset[0], offset[1] + shake_offset[1])
+    if isinstance(_img, PaletteFrame):
+      _img.blit(_background, offset)
+    else:
+      _background.paste(_img, offset, mask=_img)
     if background is None:
       return _background
 
@@ -201,12 +337,30 @@ class AnimImg:
         self.key_x_reverse,
         self.shake_effect,
         self.half_speed,
-        self.repeat
+        self.repeat,
+        self.resample
       )
     )
 
 
-class AnimText:
+def rasterize_text(text: str, font=None, x: int = 0, y: int = 0):
+  # Draws the text once into an "L" mask cropped to its ink. Pasting a colour
+  # through it at box gives the same pixels as ImageDraw.text at (x, y).
+  draw = ImageDraw.Draw(Image.new("L", (1, 1)))
+  left, top, right, bottom = draw.textbbox((x, y), text, font=font)
+  if right <= left or bottom <= top:
+    return None
+  canvas = Image.new("L", (right - left, bottom - top), 0)
+  ImageDraw.Draw(canvas).text((x - left, y - top), text, font=font, fill=255)
+  bbox = canvas.getbbox()
+  if bbox is None:
+    return None
+  mask = canvas.crop(bbox)
+  box = (left + bbox[0], top + bbox[1], left + bbox[2], top + bbox[3])
+  return mask, box
+
+
+class AnimText(Frozen):
   def __init__(
     self,
     text: str,
@@ -223,12 +377,21 @@ class AnimText:
     self.typewriter_effect = typewriter_effect
     self.font = font
     self.colour = colour
+    # the complete text is rasterized once and then only blitted; ImageDraw's
+    # default ink is opaque white
+    self.ink = (255, 255, 255, 255) if colour is None else colour
+    self.raster = rasterize_text(text, font=font, x=x, y=y)
+    self._frozen = True
 
-  def render(self, background: Image, frame: int = 0):
+  def render(self, background: Image, frame: int = 0, *, typewriter: bool = None):
+    typewriter = self.typewriter_effect if typewriter is None else typewriter
+    if not typewriter or frame >= len(self.text):
+      if self.raster is not None:
+        mask, box = self.raster
+        background.paste(self.ink, box, mask)
+      return background
     draw = ImageDraw.Draw(background)
-    _text = self.text
-    if self.typewriter_effect:
-      _text = _text[:frame]
+    _text = self.text[:frame]
     if self.font is not None:
       draw.text((self.x, self.y), _text, font=self.font, fill=self.colour)
     else:
@@ -239,33 +402,250 @@ class AnimText:
     return self.text
 
 
+class Layer:
+  # One entry of a scene's draw list: a shared AnimImg/AnimText and the
+  # settings it is drawn with in this scene. None keeps the object's own.
+  def __init__(self, obj, *, shake: bool = None, repeat: bool = None, y: int = None, typewriter: bool = None):
+    self.obj = obj
+    self.shake = getattr(obj, "shake_effect", False) if shake is None else shake
+    self.repeat = repeat
+    self.y = y
+    self.typewriter = typewriter
+
+
 class AnimScene:
-  def __init__(self, arr: List, length: int, start_frame: int = 0):
-    self.frames = []
-    text_idx = 0
-    #     print([str(x) for x in arr])
-    for idx in range(start_frame, length + start_frame):
-      if isinstance(arr[0], AnimImg):
-        background = arr[0].render()
+  def __init__(self, arr: List, length: int, start_frame: int = 0, step: int = 1, offset: int = 0):
+    # Frames are composited lazily as the scene is iterated. step/offset
+    # render only every step-th frame starting at offset, for previews that
+    # keep the timing of the full frame rate.
+    self.layers = [obj if isinstance(obj, Layer) else Layer(obj) for obj in arr]
+    self.length = length
+    self.start_frame = start_frame
+    self.step = step
+    self.offset = offset
+    base = self.layers[0].obj
+    if isinstance(base, AnimImg):
+      self.size = (base.w, base.h)
+    else:
+      self.size = base.size
+    # Shake jitter is drawn up front, in frame then layer order, so frames
+    # can be rendered in any order or on several threads with the same output.
+    self.shakes = {}
+    shaking = [idx for idx, layer in enumerate(self.layers) if layer.shake]
+    if len(shaking) > 0:
+      for text_idx in self.frame_indices():
+        self.shakes[text_idx] = {idx: (random.randint(-1, 1), random.randint(-1, 1)) for idx in shaking}
+
+  def __len__(self):
+    return len(range(self.offset, self.length, self.step))
+
+  def render_frame(self, text_idx: int, background: Image = None):
+    idx = self.start_frame + text_idx
+    shakes = self.shakes.get(text_idx, {})
+    if background is None:
+      background = Image.new("RGBA", self.size, (255, 255, 255, 255))
+    else:
+      background.paste((255, 255, 255, 255), (0, 0) + self.size)
+    for layer_idx, layer in enumerate(self.layers):
+      obj = layer.obj
+      if isinstance(obj, AnimText):
+        obj.render(background, frame=text_idx, typewriter=layer.typewriter)
+      elif isinstance(obj, AnimImg):
+        # the base layer is a still background
+        obj.render(
+          background, frame=idx if layer_idx > 0 else 0,
+          repeat=layer.repeat, y=layer.y, shake_offset=shakes.get(layer_idx, (0, 0)),
+        )
       else:
-        background = arr[0]
-      for obj in arr[1:]:
-        if isinstance(obj, AnimText):
-          obj.render(background, frame=text_idx)
-        else:
-          obj.render(background, frame=idx)
-      self.frames.append(background)
-      text_idx += 1
+        background.paste(obj, (0, 0))
+    return background
+
+  def frame_indices(self):
+    return range(self.offset, self.length, self.step)
+
+  def __iter__(self):
+    for text_idx in self.frame_indices():
+      yield self.render_frame(text_idx)
+
+  @property
+  def frames(self):
+    return list(self)
+
+
+class FrameRing:
+  # Fixed pool of preallocated RGBA frame slots in shared memory. Frame n
+  # always lives in slot n % depth; a producer waits on the slot's "empty"
+  # semaphore before writing it (backpressure once the encoder is depth frames
+  # behind) and the consumer waits on its "full" semaphore, so any number of
+  # compositors can fill frames out of order while the encoder reads in order.
+  def __init__(self, size, depth: int = 8, ctx=None, name=None, empty=None, full=None):
+    self.size = size
+    self.depth = depth
+    self.frame_bytes = size[0] * size[1] * 4
+    if name is None:
+      ctx = ctx or multiprocessing.get_context()
+      self.shm = shared_memory.SharedMemory(create=True, size=self.frame_bytes * depth)
+      self.empty = [ctx.Semaphore(1) for _ in range(depth)]
+      self.full = [ctx.Semaphore(0) for _ in range(depth)]
+    else:
+      self.shm = shared_memory.SharedMemory(name=name)
+      self.empty = empty
+      self.full = full
+
+  def attach_args(self):
+    return self.size, self.depth, None, self.shm.name, self.empty, self.full
+
+  def slot_array(self, frame: int):
+    w, h = self.size
+    offset = (frame % self.depth) * self.frame_bytes
+    return np.ndarray((h, w, 4), dtype=np.uint8, buffer=self.shm.buf, offset=offset)
+
+  def slot_image(self, frame: int):
+    offset = (frame % self.depth) * self.frame_bytes
+    img = Image.frombuffer(
+      "RGBA", self.size, self.shm.buf[offset:offset + self.frame_bytes], "raw", "RGBA", 0, 1
+    )
+    # frombuffer images are flagged read-only and would be copied on the first
+    # paste; clearing the flag makes compositing write straight into the slot
+    img.readonly = 0
+    return img
+
+  def acquire(self, frame: int, timeout=None):
+    return self.empty[frame % self.depth].acquire(timeout=timeout)
+
+  def commit(self, frame: int):
+    self.full[frame % self.depth].release()
+
+  def wait(self, frame: int):
+    self.full[frame % self.depth].acquire()
+
+  def release(self, frame: int):
+    self.empty[frame % self.depth].release()
+
+  def close(self, unlink=False):
+    # Slot images still referenced from a failed render's traceback keep the
+    # buffer exported, so close() can raise BufferError. The segment is
+    # unlinked first regardless, and the mapping is then left to go with the
+    # images rather than hide the render error.
+    if unlink:
+      self.shm.unlink()
+    try:
+      self.shm.close()
+    except BufferError:
+      pass
+
+
+def _encode_frames(ring_args, total_frames, output_path, codec, fps):
+  ring = FrameRing(*ring_args)
+  w, h = ring.size
+  video = cv2.VideoWriter(output_path, codec, fps, ring.size)
+  if not video.isOpened():
+    # exits with an error, which FrameWriter reports instead of waiting
+    raise RuntimeError(f"could not open {output_path} for writing at {fps} fps")
+  bgr = np.empty((h, w, 3), dtype=np.uint8)
+  frame = 0
+  while True:
+    ring.wait(frame)
+    if frame == total_frames.value:
+      break
+    cv2.cvtColor(ring.slot_array(frame), cv2.COLOR_RGBA2BGR, dst=bgr)
+    video.write(bgr)
+    ring.release(frame)
+    frame += 1
+  video.release()
+  ring.close()
+
+
+class FrameWriter:
+  # Composites frames straight into a FrameRing while a separate encoder
+  # process converts and writes them, so compositing and encoding overlap.
+  # With render_workers > 1 frames are composited on a thread pool; PIL
+  # releases the GIL while pasting, and the ring lets frames finish out of
+  # order. ring depth bounds how many frames are in flight.
+  def __init__(self, output_path, codec, fps, size, depth: int = 8, render_workers: int = None):
+    # the caller may already be running threads (audio mixing, the render
+    # pool), which a forked encoder would inherit mid-state. Neither start
+    # method can run the encoder without importing the caller's __main__, so
+    # scripts must guard their entry point; the forkserver itself is kept
+    # from importing it, where an unguarded script would hang.
+    start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    ctx = multiprocessing.get_context(start_method)
+    if start_method == "forkserver":
+      ctx.set_forkserver_preload([])
+    self.ring = FrameRing(size, depth=depth, ctx=ctx)
+    self.total_frames = ctx.Value("q", -1)
+    self.frame_count = 0
+    self.encoder = ctx.Process(
+      target=_encode_frames,
+      args=(self.ring.attach_args(), self.total_frames, output_path, codec, fps),
+      daemon=True,
+    )
+    self.encoder.start()
+    self.pool = None
+    self.pending = []
+    if render_workers is not None and render_workers > 1:
+      self.pool = ThreadPoolExecutor(max_workers=render_workers)
+
+  def acquire(self, frame: int):
+    # slots are only freed by the encoder, so if it dies this would wait
+    # forever
+    while not self.ring.acquire(frame, timeout=1):
+      if not self.encoder.is_alive():
+        raise RuntimeError(f"frame encoder exited with code {self.encoder.exitcode}")
+
+  def render_into(self, scene: AnimScene, text_idx: int, frame: int):
+    try:
+      scene.render_frame(text_idx, background=self.ring.slot_image(frame))
+    finally:
+      # pooled frames are already counted, so a failed one is still committed
+      # or the encoder would wait on its slot forever
+      self.ring.commit(frame)
+
+  def write_scene(self, scene: AnimScene):
+    for text_idx in scene.frame_indices():
+      frame = self.frame_count
+      self.acquire(frame)
+      if self.pool is None:
+        scene.render_frame(text_idx, background=self.ring.slot_image(frame))
+        self.ring.commit(frame)
+      else:
+        self.pending.append(self.pool.submit(self.render_into, scene, text_idx, frame))
+        # surface render errors as they happen
+        for future in [f for f in self.pending if f.done()]:
+          self.pending.remove(future)
+          future.result()
+      self.frame_count += 1
+
+  def close(self):
+    errors = []
+    if self.pool is not None:
+      self.pool.shutdown(wait=True)
+      errors = [f.exception() for f in self.pending if f.exception() is not None]
+    self.total_frames.value = self.frame_count
+    self.ring.commit(self.frame_count)
+    self.encoder.join()
+    self.ring.close(unlink=True)
+    if len(errors) > 0:
+      raise errors[0]
+    if self.encoder.exitcode != 0:
+      raise RuntimeError(f"frame encoder exited with code {self.encoder.exitcode}")
 
 
 class AnimVideo:
-  def __init__(self, scenes: List[AnimScene], fps: int = 10, extension='mp4', codec=None):
+  def __init__(
+    self, scenes: Iterable[AnimScene], fps: int = 10, extension='mp4', codec=None, ring_depth: int = 8,
+    render_workers: int = None,
+  ):
+    # scenes may be a generator, in which case each scene is rendered as soon
+    # as it is produced
     self.scenes = scenes
     self.fps = fps
     if codec is None:
       codec = cv2.VideoWriter_fourcc(*'MPEG')
     self.codec = codec
     self.extension = extension
+    self.ring_depth = ring_depth
+    self.render_workers = render_workers
 
   def render(self, output_path: str = None):
     if output_path is None:
@@ -273,21 +653,17 @@ class AnimVideo:
         os.makedirs("tmp")
       rnd_hash = random.getrandbits(64)
       output_path = f"tmp/{rnd_hash}.{self.extension}"
-    background = self.scenes[0].frames[0]
     if os.path.isfile(output_path):
       os.remove(output_path)
-    video = cv2.VideoWriter(output_path, self.codec, self.fps, background.size)
-    for scene in self.scenes:
-      for frame in scene.frames:
-        video.write(cv2.cvtColor(np.array(frame), cv2.COLOR_RGB2BGR))
-    video.release()
+    writer = None
+    try:
+      for scene in self.scenes:
+        if writer is None:
+          writer = FrameWriter(
+            output_path, self.codec, self.fps, scene.size, depth=self.ring_depth, render_workers=self.render_workers
+          )
+        writer.write_scene(scene)
+    finally:
+      if writer is not None:
+        writer.close()
     return output_path
-
-
-def add_margin(pil_img, top, right, bottom, left):
-  width, height = pil_img.size
-  new_width = width + right + left
-  new_height = height + top + bottom
-  result = Image.new(pil_img.mode, (new_width, new_height), (0, 0, 0, 0))
-  result.paste(pil_img, (left, top))
-  return result
@@ -0,0 +1,264 @@
+import hashlib
+import json
+import numpy as np
+import os
+
+from concurrent.futures import ThreadPoolExecutor
+from pydub import AudioSegment
+from typing import List, Dict
+
+from script_constants import Action, Character, Location, location_map, character_map, character_emotions, \
+  sound_effect_map, objection_audio_map, blip_voice_map, character_voice_map
+
+from animation import anim_cache, KeyLocks
+from timeline import Timeline
+
+
+class MissingAssetsError(FileNotFoundError):
+  def __init__(self, missing: List[str]):
+    self.missing = missing
+    report = "\n".join(f"  {m}" for m in missing)
+    super().__init__(f"{len(missing)} missing assets:\n{report}")
+
+
+def _sprite_prefix(character: Character):
+  return f"{str(character).lower()}-"
+
+
+class AssetIndex:
+  def __init__(self, assets_folder, sprites: Dict = None, files=None, fingerprint=None):
+    self.assets_folder = assets_folder
+    # {Character: {emotion: (talking_path, idle_path)}}
+    self.sprites = sprites if sprites is not None else {}
+    self.files = set(files) if files is not None else set()
+    self.fingerprint = fingerprint
+
+  @staticmethod
+  def fingerprint_folder(assets_folder):
+    # directory mtimes change whenever an entry is added, removed or renamed,
+    # so a handful of stats is enough to detect a stale index
+    h = hashlib.sha1(os.path.abspath(assets_folder).encode())
+    for path in [assets_folder] + [f"{assets_folder}/{d}" for d in character_map.values()]:
+      try:
+        h.update(f"{path}:{os.stat(path).st_mtime_ns}".encode())
+      except FileNotFoundError:
+        h.update(f"{path}:-".encode())
+    return h.hexdigest()
+
+  @classmethod
+  def scan(cls, assets_folder):
+    files = set(os.listdir(assets_folder))
+    sprites = {}
+    for character, sprite_dir in character_map.items():
+      _dir = f"{assets_folder}/{sprite_dir}"
+      if not os.path.isdir(_dir):
+        continue
+      listing = set(os.listdir(_dir))
+      prefix = _sprite_prefix(character)
+      emotions = {"normal"}
+      for name in listing:
+        if name.startswith(prefix) and name.endswith(".gif"):
+          emotions.add(name[len(prefix):-len(".gif")].replace("(a)", "").replace("(b)", ""))
+      sprites[character] = {}
+      for emotion in emotions:
+        idle = f"{prefix}{emotion}(a).gif"
+        if idle in listing:
+          talking = idle.replace("(a)", "(b)")
+          if talking not in listing:
+            continue
+        else:
+          idle = talking = f"{prefix}{emotion}.gif"
+          if idle not in listing:
+            continue
+        sprites[character][emotion] = (f"{_dir}/{talking}", f"{_dir}/{idle}")
+    return cls(assets_folder, sprites, files, cls.fingerprint_folder(assets_folder))
+
+  @classmethod
+  def load(cls, assets_folder, index_path=None):
+    fingerprint = cls.fingerprint_folder(assets_folder)
+    if index_path is not None and os.path.isfile(index_path):
+      with open(index_path) as f:
+        data = json.load(f)
+      if data.get("fingerprint") == fingerprint:
+        sprites = {
+          Character[name]: {emotion: tuple(paths) for emotion, paths in emotions.items()}
+          for name, emotions in data["sprites"].items()
+        }
+        return cls(assets_folder, sprites, data["files"], fingerprint)
+    index = cls.scan(assets_folder)
+    if index_path is not None:
+      index.save(index_path)
+    return index
+
+  def save(self, index_path):
+    data = {
+      "fingerprint": self.fingerprint,
+      "files": sorted(self.files),
+      "sprites": {
+        character.name: {emotion: list(paths) for emotion, paths in emotions.items()}
+        for character, emotions in self.sprites.items()
+      },
+    }
+    with open(index_path, "w") as f:
+      json.dump(data, f, indent=1)
+
+  def resolve(self, character: Character, emotion: str):
+    try:
+      return self.sprites[character][emotion]
+    except KeyError:
+      raise MissingAssetsError([self._sprite_description(character, emotion)]) from None
+
+  def _sprite_description(self, character, emotion):
+    prefix = _sprite_prefix(character)
+    return f"{self.assets_folder}/{character_map[character]}/{prefix}{emotion}(a).gif or {prefix}{emotion}.gif"
+
+  def missing_sprites(self, characters=None):
+    # every sprite comments_to_scene may pick for these characters, so the
+    # report doesn't depend on where its random choice lands
+    missing = []
+    for character, emotions in character_emotions.items():
+      if characters is not None and character not in characters:
+        continue
+      for emotion in sorted({e for choices in emotions.values() for e in choices}):
+        if emotion not in self.sprites.get(character, {}):
+          missing.append(self._sprite_description(character, emotion))
+    return missing
+
+  def missing(self, config: List[Dict]):
+    missing = []
+    needed_files = {"arrow.png", "textbox4.png", "objection.gif"}
+    # files in subfolders aren't in the index, and edits inside them don't
+    # change its fingerprint, so they are checked on disk
+    needed_paths = {"igiari/Igiari.ttf"} | set(sound_effect_map.values()) | set(objection_audio_map.values())
+    character = None
+    characters = set()
+    for scene_index, scene in enumerate(config):
+      needed_files.add(location_map[scene["location"]])
+      if scene["location"] == Location.COURTROOM_LEFT:
+        needed_files.add("logo-left.png")
+      elif scene["location"] == Location.COURTROOM_RIGHT:
+        needed_files.add("logo-right.png")
+      elif scene["location"] == Location.WITNESS_STAND:
+        needed_files.add("witness_stand.png")
+      if "audio" in scene:
+        needed_files.add(f'{scene["audio"]}.mp3')
+      for obj in scene["scene"]:
+        if "character" in obj:
+          character = obj["character"]
+          characters.add(character)
+        if character is None:
+          missing.append(f"character for scene {scene_index}: no character set before its first object")
+          break
+        if "character" in obj or "emotion" in obj:
+          emotion = obj.get("emotion", "normal")
+          if emotion not in self.sprites.get(character, {}):
+            description = self._sprite_description(character, emotion)
+            if description not in missing:
+              missing.append(description)
+        if obj.get("action") in (Action.TEXT, Action.TEXT_SHAKE_EFFECT):
+          needed_paths.add(blip_voice_map[character_voice_map.get(character, "male")])
+    missing += [description for description in self.missing_sprites(characters) if description not in missing]
+    for name in sorted(needed_files):
+      if name not in self.files:
+        missing.append(f"{self.assets_folder}/{name}")
+    for name in sorted(needed_paths):
+      if not os.path.isfile(f"{self.assets_folder}/{name}"):
+        missing.append(f"{self.assets_folder}/{name}")
+    return missing
+
+  def validate(self, config: List[Dict]):
+    missing = self.missing(config)
+    if len(missing) > 0:
+      raise MissingAssetsError(missing)
+
+
+def audio_segment_to_samples(sound: AudioSegment, sample_rate=44100, channels=2):
+  sound = sound.set_frame_rate(sample_rate).set_channels(channels).set_sample_width(2)
+  return np.array(sound.get_array_of_samples(), dtype=np.int32).reshape(-1, channels)
+
+
+class SoundCache:
+  def __init__(self):
+    self._cache = {}
+    self._samples_cache = {}
+    self._locks = KeyLocks()
+
+  def get_sound(self, path):
+    return self._locks.get_or_create(
+      self._cache, path, lambda: AudioSegment.from_file(path, format=os.path.splitext(path)[1][1:])
+    )
+
+  def get_samples(self, path, sample_rate=44100, gain=0):
+    key = (path, sample_rate, gain)
+    return self._locks.get_or_create(
+      self._samples_cache, key, lambda: audio_segment_to_samples(self.get_sound(path) + gain, sample_rate)
+    )
+
+
+sound_cache = SoundCache()
+
+# the mixer loads these sounds with a gain, which is part of the samples key
+sound_gains = {sound_effect_map["blink"]: -10}
+
+
+def scene_assets(timeline: Timeline, assets_folder, asset_index: AssetIndex, resample=None):
+  # mirrors the anim_cache lookups made by engine.do_video so that pre-warmed
+  # entries are hits during rendering
+  images = {}
+  fonts = {(f"{assets_folder}/igiari/Igiari.ttf", 12), (f"{assets_folder}/igiari/Igiari.ttf", 15)}
+  sounds = {f"{assets_folder}/{path}" for path in sound_effect_map.values()}
+  sounds |= {f"{assets_folder}/{path}" for path in objection_audio_map.values()}
+
+  def add_image(path, **kwargs):
+    kwargs["resample"] = resample
+    images.setdefault(path, {})[tuple(sorted(kwargs.items()))] = kwargs
+
+  add_image(f"{assets_folder}/arrow.png", x=235, y=170, w=15, h=15, key_x=5)
+  add_image(f"{assets_folder}/objection.gif")
+  for segment in timeline.video:
+    bg_path = f'{assets_folder}/{location_map[segment["location"]]}'
+    bg_w = anim_cache.get_image(bg_path).size[0]
+    add_image(bg_path)
+    add_image(f"{assets_folder}/textbox4.png", w=bg_w)
+    if segment["location"] == Location.COURTROOM_LEFT:
+      add_image(f"{assets_folder}/logo-left.png")
+    elif segment["location"] == Location.COURTROOM_RIGHT:
+      add_image(f"{assets_folder}/logo-right.png")
+    elif segment["location"] == Location.WITNESS_STAND:
+      add_image(f"{assets_folder}/witness_stand.png", w=bg_w)
+    if segment["character"] is not None:
+      talking_path, idle_path = asset_index.resolve(segment["character"], segment["emotion"])
+      add_image(talking_path if segment["sprite"] == "talking" else idle_path, half_speed=True)
+  for cue in timeline.audio:
+    if cue["_type"] == "music":
+      sounds.add(f'{assets_folder}/{cue["audio"]}.mp3')
+    elif cue["_type"] == "bip":
+      sounds.add(f'{assets_folder}/{blip_voice_map[cue["voice"]]}')
+  return {
+    "images": {path: list(specs.values()) for path, specs in images.items()},
+    "fonts": sorted(fonts),
+    "sounds": sorted(sounds),
+  }
+
+
+def prewarm_assets(timeline: Timeline, assets_folder, asset_index: AssetIndex, workers=8, resample=None):
+  assets = scene_assets(timeline, assets_folder, asset_index, resample=resample)
+
+  # one task per path; anim_cache also serialises seeks of a shared image
+  def load_images(path, specs):
+    for kwargs in specs:
+      anim_cache.get_anim_img(path, **kwargs)
+
+  with ThreadPoolExecutor(max_workers=workers) as pool:
+    futures = [pool.submit(load_images, path, specs) for path, specs in assets["images"].items()]
+    futures += [pool.submit(anim_cache.get_font, path, size) for path, size in assets["fonts"]]
+    futures += [
+      pool.submit(
+        sound_cache.get_samples, path, sample_rate=timeline.sample_rate,
+        gain=sound_gains.get(os.path.relpath(path, assets_folder), 0),
+      )
+      for path in assets["sounds"]
+    ]
+    for future in futures:
+      future.result()
+  return assets
@@ -0,0 +1,104 @@
+import argparse
+import cv2
+import ffmpeg
+import os
+import time
+
+from encoding import encoding_profiles, output_kwargs
+
+
+def benchmark_encoding(video_path, fps=18, video_codec='libx264', output_folder='tmp'):
+  if not os.path.exists(output_folder):
+    os.makedirs(output_folder)
+  capture = cv2.VideoCapture(video_path)
+  frame_count = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+  capture.release()
+  results = {}
+  for profile in encoding_profiles:
+    output_path = f"{output_folder}/bench-{profile}.mp4"
+    if os.path.exists(output_path):
+      os.remove(output_path)
+    out = ffmpeg.input(video_path).output(
+      output_path, **output_kwargs(profile, fps, video_codec=video_codec, audio_codec=None)
+    )
+    start = time.perf_counter()
+    out.run(capture_stdout=True, capture_stderr=True)
+    elapsed = time.perf_counter() - start
+    results[profile] = {
+      "frames": frame_count,
+      "seconds": elapsed,
+      "fps": frame_count / elapsed,
+      "bytes": os.path.getsize(output_path),
+    }
+  return results
+
+
+def benchmark_emotions(texts, backends, model_name=None, batch_size=16, workers=None, threads=1):
+  # imported here so the encode benchmark doesn't need torch installed
+  import emotion
+
+  model_name = model_name or emotion.default_model
+  results = {}
+  reference = None
+  for name in backends:
+    start = time.perf_counter()
+    if workers:
+      backend = emotion.TaggingPool(name, model_name, workers=workers, threads=threads, batch_size=batch_size)
+    else:
+      backend = emotion.get_backend(name, model_name)
+    load_seconds = time.perf_counter() - start
+    backend.predict(texts[:batch_size])
+    labels = []
+    start = time.perf_counter()
+    for idx in range(0, len(texts), batch_size):
+      labels += [label for label, _ in backend.predict(texts[idx:idx + batch_size])]
+    elapsed = time.perf_counter() - start
+    if workers:
+      backend.close()
+    if reference is None:
+      reference = labels
+    results[name] = {
+      "load_seconds": load_seconds,
+      "seconds": elapsed,
+      "texts_per_second": len(texts) / elapsed,
+      # label agreement with the first backend
+      "agreement": sum(a == b for a, b in zip(labels, reference)) / len(texts),
+    }
+  return results
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser()
+  subparsers = parser.add_subparsers(dest="command", required=True)
+  encode_parser = subparsers.add_parser("encode", help="encode fps per encoding profile")
+  encode_parser.add_argument("video", help="cached video written by do_video, e.g. cache/video.avi")
+  encode_parser.add_argument("--fps", type=int, default=18)
+  encode_parser.add_argument("--video-codec", default="libx264")
+  emotion_parser = subparsers.add_parser("emotion", help="emotion tagging throughput and agreement per backend")
+  emotion_parser.add_argument("texts", help="text file with one comment per line")
+  emotion_parser.add_argument(
+    "--backends", nargs="+", default=["generate", "generate-int8", "score", "score-int8", "onnx", "onnx-int8"],
+    help="the first backend is the reference for label agreement",
+  )
+  emotion_parser.add_argument("--model", default=None)
+  emotion_parser.add_argument("--batch-size", type=int, default=16)
+  emotion_parser.add_argument("--workers", type=int, default=None, help="tag in a process pool of this size")
+  emotion_parser.add_argument("--threads", type=int, default=1, help="intra-op threads per pool worker")
+  args = parser.parse_args()
+
+  if args.command == "encode":
+    results = benchmark_encoding(args.video, fps=args.fps, video_codec=args.video_codec)
+    for profile, r in results.items():
+      print(f"{profile:>14}: {r['fps']:8.1f} fps  {r['seconds']:6.2f}s  {r['bytes'] / 1024:8.1f} KiB")
+  elif args.command == "emotion":
+    with open(args.texts) as f:
+      texts = [line.strip() for line in f if line.strip() != ""]
+    results = benchmark_emotions(
+      texts, args.backends, model_name=args.model, batch_size=args.batch_size, workers=args.workers,
+      threads=args.threads,
+    )
+    for name, r in results.items():
+      print(
+        f"{name:>14}: {r['texts_per_second']:8.1f} texts/s  {r['seconds']:6.2f}s  "
+        f"load {r['load_seconds']:6.2f}s  agreement {r['agreement'] * 100:5.1f}%"
+      )
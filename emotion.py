@@ -0,0 +1,272 @@
+import math
+import multiprocessing
+import os
+
+import numpy as np
+import torch
+
+from transformers import AutoTokenizer, AutoModelForSeq2SeqLM
+
+from script_constants import character_emotions
+
+default_model = 'mrm8488/t5-base-finetuned-emotion'
+
+# every character maps the same emotion classes to sprites
+emotion_labels = list(dict.fromkeys(label for emotions in character_emotions.values() for label in emotions))
+
+
+def _prepare(texts):
+  return [text + '</s>' for text in texts]
+
+
+def label_token_ids(tokenizer, labels=emotion_labels):
+  # The model answers with a single label token, so each label is identified
+  # by its first token. Two labels sharing one would be indistinguishable.
+  token_ids = [tokenizer(label, add_special_tokens=False).input_ids[0] for label in labels]
+  if len(set(token_ids)) != len(token_ids):
+    raise ValueError(f"emotion labels {labels} do not start with distinct tokens")
+  return token_ids
+
+
+def _softmax(logits):
+  logits = logits - logits.max(axis=-1, keepdims=True)
+  exp = np.exp(logits)
+  return exp / exp.sum(axis=-1, keepdims=True)
+
+
+def _pick(logits, labels):
+  probs = _softmax(np.asarray(logits, dtype=np.float32))
+  best = probs.argmax(axis=-1)
+  return [(labels[idx], float(probs[row, idx])) for row, idx in enumerate(best)]
+
+
+def _tmp_path(path):
+  # written next to path and moved into place, so readers never open a
+  # partial file
+  return path.replace('.onnx', f'.{os.getpid()}.tmp.onnx')
+
+
+def load_model(model_name=default_model, quantize=False):
+  tokenizer = AutoTokenizer.from_pretrained(model_name)
+  model = AutoModelForSeq2SeqLM.from_pretrained(model_name).eval()
+  if quantize:
+    # int8 weights for every Linear layer, activations quantized on the fly
+    model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+  return tokenizer, model
+
+
+class GenerateBackend:
+  # The original tagger: autoregressive decoding of one token, mapped back to
+  # the label starting with that token.
+  fork_safe = True
+
+  def __init__(self, model_name=default_model, quantize=False, labels=emotion_labels):
+    self.tokenizer, self.model = load_model(model_name, quantize=quantize)
+    self.labels = labels
+    self.token_labels = dict(zip(label_token_ids(self.tokenizer, labels), labels))
+
+  def predict(self, texts):
+    inputs = self.tokenizer(_prepare(texts), padding=True, return_tensors='pt')
+    with torch.inference_mode():
+      output = self.model.generate(
+        input_ids=inputs.input_ids,
+        attention_mask=inputs.attention_mask,
+        max_length=2,
+        output_scores=True,
+        return_dict_in_generate=True,
+      )
+    probs = torch.softmax(output.scores[0], dim=-1)
+    results = []
+    for row, token_id in enumerate(output.sequences[:, 1].tolist()):
+      label = self.token_labels.get(token_id)
+      if label is None:
+        label = self.tokenizer.decode([token_id]).replace('<pad>', '').strip()
+      results.append((label, float(probs[row, token_id])))
+    return results
+
+
+class ScoreBackend:
+  # A single decoder step from the start token, with the argmax taken only
+  # over the first tokens of the known labels, so the answer is always a
+  # valid emotion and no generation loop runs.
+  fork_safe = True
+
+  def __init__(self, model_name=default_model, quantize=False, labels=emotion_labels):
+    self.tokenizer, self.model = load_model(model_name, quantize=quantize)
+    self.labels = labels
+    self.token_ids = torch.tensor(label_token_ids(self.tokenizer, labels))
+    self.start_id = self.model.config.decoder_start_token_id
+
+  def predict(self, texts):
+    inputs = self.tokenizer(_prepare(texts), padding=True, return_tensors='pt')
+    decoder_input_ids = torch.full((len(texts), 1), self.start_id, dtype=torch.long)
+    with torch.inference_mode():
+      logits = self.model(
+        input_ids=inputs.input_ids,
+        attention_mask=inputs.attention_mask,
+        decoder_input_ids=decoder_input_ids,
+      ).logits[:, 0, self.token_ids]
+    return _pick(logits.numpy(), self.labels)
+
+
+class _LabelLogits(torch.nn.Module):
+  def __init__(self, model, token_ids, start_id):
+    super().__init__()
+    self.model = model
+    self.register_buffer("token_ids", token_ids)
+    self.start_id = start_id
+
+  def forward(self, input_ids, attention_mask):
+    decoder_input_ids = torch.full_like(input_ids[:, :1], self.start_id)
+    logits = self.model(
+      input_ids=input_ids, attention_mask=attention_mask, decoder_input_ids=decoder_input_ids
+    ).logits
+    return logits[:, 0, self.token_ids]
+
+
+class OnnxBackend:
+  # The ScoreBackend graph exported to ONNX and run with ONNX Runtime. The
+  # export is cached under onnx_folder and reused on the next run. Sessions
+  # own thread pools that don't survive a fork, so pool workers each load one,
+  # after TaggingPool has run prepare once in the parent.
+  fork_safe = False
+
+  def __init__(
+      self, model_name=default_model, quantize=False, labels=emotion_labels, onnx_folder='cache/onnx', threads=0
+  ):
+    import onnxruntime
+
+    self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+    self.labels = labels
+    onnx_path = self.prepare(model_name, quantize=quantize, labels=labels, onnx_folder=onnx_folder)
+    options = onnxruntime.SessionOptions()
+    options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+    options.intra_op_num_threads = threads
+    self.session = onnxruntime.InferenceSession(onnx_path, options, providers=['CPUExecutionProvider'])
+
+  @classmethod
+  def prepare(cls, model_name=default_model, quantize=False, labels=emotion_labels, onnx_folder='cache/onnx', **kwargs):
+    # exports and quantizes the model unless cached, returning the path to load
+    name = model_name.replace('/', '--')
+    onnx_path = f"{onnx_folder}/{name}-{'-'.join(labels)}.onnx"
+    if not os.path.exists(onnx_path):
+      cls.export(model_name, labels, onnx_path)
+    if quantize:
+      quantized_path = onnx_path.replace('.onnx', '-int8.onnx')
+      if not os.path.exists(quantized_path):
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        tmp_path = _tmp_path(quantized_path)
+        quantize_dynamic(onnx_path, tmp_path, weight_type=QuantType.QInt8)
+        os.replace(tmp_path, quantized_path)
+      onnx_path = quantized_path
+    return onnx_path
+
+  @staticmethod
+  def export(model_name, labels, onnx_path):
+    os.makedirs(os.path.dirname(onnx_path), exist_ok=True)
+    tokenizer, model = load_model(model_name)
+    token_ids = torch.tensor(label_token_ids(tokenizer, labels))
+    wrapper = _LabelLogits(model, token_ids, model.config.decoder_start_token_id).eval()
+    inputs = tokenizer(_prepare(['Objection!', 'Hold it right there.']), padding=True, return_tensors='pt')
+    tmp_path = _tmp_path(onnx_path)
+    torch.onnx.export(
+      wrapper,
+      (inputs.input_ids, inputs.attention_mask),
+      tmp_path,
+      input_names=['input_ids', 'attention_mask'],
+      output_names=['logits'],
+      dynamic_axes={
+        'input_ids': {0: 'batch', 1: 'sequence'},
+        'attention_mask': {0: 'batch', 1: 'sequence'},
+        'logits': {0: 'batch'},
+      },
+      opset_version=14,
+    )
+    os.replace(tmp_path, onnx_path)
+
+  def predict(self, texts):
+    inputs = self.tokenizer(_prepare(texts), padding=True, return_tensors='np')
+    logits, = self.session.run(None, {
+      'input_ids': inputs['input_ids'].astype(np.int64),
+      'attention_mask': inputs['attention_mask'].astype(np.int64),
+    })
+    return _pick(logits, self.labels)
+
+
+emotion_backends = {
+  "generate": (GenerateBackend, {}),
+  "generate-int8": (GenerateBackend, {"quantize": True}),
+  "score": (ScoreBackend, {}),
+  "score-int8": (ScoreBackend, {"quantize": True}),
+  "onnx": (OnnxBackend, {}),
+  "onnx-int8": (OnnxBackend, {"quantize": True}),
+}
+
+
+def get_backend_class(backend):
+  if backend not in emotion_backends:
+    raise ValueError(f"unknown emotion backend {backend!r}, expected one of {sorted(emotion_backends)}")
+  return emotion_backends[backend][0]
+
+
+def get_backend(backend, model_name=default_model, **kwargs):
+  cls = get_backend_class(backend)
+  return cls(model_name, **dict(emotion_backends[backend][1], **kwargs))
+
+
+_worker_backend = None
+
+
+def _init_worker(backend, model_name, kwargs, threads):
+  global _worker_backend
+  torch.set_num_threads(threads)
+  if _worker_backend is None:
+    if get_backend_class(backend) is OnnxBackend:
+      kwargs = dict(kwargs, threads=threads)
+    _worker_backend = get_backend(backend, model_name, **kwargs)
+
+
+def _predict_batch(texts):
+  return _worker_backend.predict(texts)
+
+
+class TaggingPool:
+  # Shards texts across worker processes, each running one backend with
+  # `threads` intra-op threads. With fork the model is loaded once in this
+  # process before the workers start, so they share its weights copy-on-write
+  # instead of holding one copy each; otherwise every worker loads its own.
+  # The pool stays up between predict calls, so keep one per run.
+  def __init__(self, backend='score', model_name=default_model, workers=None, threads=1, batch_size=16, **kwargs):
+    global _worker_backend
+    self.batch_size = batch_size
+    self.workers = workers or max(1, (os.cpu_count() or 1) // threads)
+    cls = get_backend_class(backend)
+    fork = "fork" in multiprocessing.get_all_start_methods() and cls.fork_safe
+    context = multiprocessing.get_context("fork" if fork else None)
+    if fork:
+      _worker_backend = get_backend(backend, model_name, **kwargs)
+    elif hasattr(cls, "prepare"):
+      # one export for the pool, not one per worker racing on the same files
+      cls.prepare(model_name, **dict(emotion_backends[backend][1], **kwargs))
+    try:
+      self._pool = context.Pool(self.workers, initializer=_init_worker, initargs=(backend, model_name, kwargs, threads))
+    finally:
+      # the parent only holds the model long enough to fork it
+      _worker_backend = None
+
+  def predict(self, texts):
+    # small inputs are split finer so every worker gets a share
+    size = max(1, min(self.batch_size, math.ceil(len(texts) / self.workers)))
+    batches = [texts[idx:idx + size] for idx in range(0, len(texts), size)]
+    # map keeps batch order, so results line up with texts
+    return [result for batch in self._pool.map(_predict_batch, batches) for result in batch]
+
+  def close(self):
+    self._pool.close()
+    self._pool.join()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
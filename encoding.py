@@ -0,0 +1,108 @@
+import ffmpeg
+
+from typing import Dict, List, Union
+
+# x264 settings for flat cartoon art with mostly static frames: tune=animation
+# favours larger flat blocks and more reference frames, and long GOPs are cheap
+# because most frames are near-duplicates of the previous one.
+encoding_profiles = {
+  "fast-preview": {
+    "preset": "ultrafast",
+    "crf": 30,
+    "tune": "animation",
+    "pix_fmt": "yuv420p",
+    "gop_seconds": 10,
+    "threads": 0,
+  },
+  "production": {
+    "preset": "faster",
+    "crf": 20,
+    "tune": "animation",
+    "pix_fmt": "yuv420p",
+    "gop_seconds": 5,
+    "threads": 0,
+  },
+  "archive": {
+    "preset": "slow",
+    "crf": 14,
+    "tune": "animation",
+    "pix_fmt": "yuv444p",
+    "gop_seconds": 10,
+    "threads": 0,
+  },
+}
+
+# Output sizes for the native 256x192 frames. Nearest-neighbour keeps the
+# pixel art sharp when upscaling; the small preview is averaged down instead.
+# A width or height of -2 keeps the aspect ratio with an even size.
+rendition_presets = {
+  "native": {},
+  "720p": {"height": 720, "flags": "neighbor"},
+  "1080p": {"height": 1080, "flags": "neighbor"},
+  "preview": {"height": 144, "flags": "area", "profile": "fast-preview"},
+}
+
+x264_codecs = {"libx264", "libx264rgb", "libx265"}
+
+
+def get_profile(profile: Union[str, Dict]):
+  if isinstance(profile, str):
+    if profile not in encoding_profiles:
+      raise ValueError(f"unknown encoding profile {profile!r}, expected one of {sorted(encoding_profiles)}")
+    return encoding_profiles[profile]
+  return profile
+
+
+def output_kwargs(profile: Union[str, Dict], fps, video_codec='libx264', audio_codec='aac'):
+  profile = get_profile(profile)
+  kwargs = {
+    "vcodec": video_codec,
+    "pix_fmt": profile["pix_fmt"],
+    "threads": profile["threads"],
+    "g": max(1, int(profile["gop_seconds"] * fps)),
+  }
+  if audio_codec is not None:
+    kwargs["acodec"] = audio_codec
+  if video_codec in x264_codecs:
+    kwargs["preset"] = profile["preset"]
+    kwargs["crf"] = profile["crf"]
+    kwargs["tune"] = profile["tune"]
+  return kwargs
+
+
+def get_rendition(rendition: Dict):
+  # a rendition is {"output": path} plus an optional "preset" name and any
+  # of width, height, flags, profile, video_codec and options to override it
+  preset = rendition.get("preset", "native")
+  if preset not in rendition_presets:
+    raise ValueError(f"unknown rendition preset {preset!r}, expected one of {sorted(rendition_presets)}")
+  return dict(rendition_presets[preset], **rendition)
+
+
+def rendition_outputs(
+    video, audio, renditions: List[Dict], fps,
+    video_codec='libx264', audio_codec='copy', profile='production', output_options: Dict = None,
+):
+  # one split feeds every rendition, so the input is decoded once however
+  # many sizes are written; pass the result to ffmpeg.merge_outputs
+  renditions = [get_rendition(r) for r in renditions]
+  if len(renditions) == 1:
+    streams = [video]
+  else:
+    split = video.filter_multi_output("split", len(renditions))
+    streams = [split[idx] for idx in range(len(renditions))]
+  outputs = []
+  for stream, rendition in zip(streams, renditions):
+    if "width" in rendition or "height" in rendition:
+      stream = stream.filter(
+        "scale", rendition.get("width", -2), rendition.get("height", -2), flags=rendition.get("flags", "bicubic")
+      )
+    kwargs = output_kwargs(
+      rendition.get("profile", profile), fps,
+      video_codec=rendition.get("video_codec", video_codec), audio_codec=audio_codec,
+    )
+    kwargs.update(output_options or {})
+    kwargs.update(rendition.get("options", {}))
+    streams = [stream] if audio is None else [stream, audio]
+    outputs.append(ffmpeg.output(*streams, rendition["output"], strict="experimental", **kwargs))
+  return outputs
@@ -1,306 +1,182 @@
 import cv2
 import ffmpeg
+import math
+import numpy as np
 import os
 import random
-import spacy
 import string
+import time
 
+from PIL import Image
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from pydub import AudioSegment
 from textwrap import wrap
 from typing import List, Dict
 from tqdm import tqdm
 
-from script_constants import Location, Character, Action, location_map, character_map, character_location_map, \
-  audio_emotions, character_emotions, objection_emotions
+from script_constants import Location, Character, Action, location_map, character_location_map, \
+  audio_emotions, character_emotions, objection_emotions, sound_effect_map, objection_audio_map, \
+  blip_voice_map
 
-from animation import anim_cache, AnimScene, AnimVideo
+from animation import anim_cache, AnimScene, AnimVideo, Layer
+from assets import AssetIndex, sound_cache, sound_gains, prewarm_assets
+from encoding import rendition_outputs
+from planning import render_history_path, record_render, rendered_frame_count, frame_size
+from timeline import Timeline, build_timeline, split_config, split_str_into_newlines
 
 
-def split_str_into_newlines(text: str, max_line_count: int = 34):
-  words = text.split(" ")
-  new_text = ""
-  for word in words:
-    last_sentence = new_text.split("\n")[-1] + word + " "
-    if len(last_sentence) >= max_line_count:
-      new_text += "\n" + word + " "
-    else:
-      new_text += word + " "
-  return new_text
+def iter_scenes(
+    timeline: Timeline, assets_folder, asset_index: AssetIndex = None, frame_step=1, typewriter=True, resample=None
+):
+  if asset_index is None:
+    asset_index = AssetIndex.scan(assets_folder)
+  font_path = f"{assets_folder}/igiari/Igiari.ttf"
+  arrow = anim_cache.get_anim_img(
+    f"{assets_folder}/arrow.png", x=235, y=170, w=15, h=15, key_x=5, resample=resample
+  )
+  objection = anim_cache.get_anim_img(f"{assets_folder}/objection.gif", resample=resample)
+  for segment in tqdm(timeline.video, total=len(timeline.video), desc='creating video...'):
+    # cached objects are shared and read-only; per-segment shake, repeat,
+    # position and typewriter settings go on the scene's layers
+    shake = segment.get("shake", False)
+    bg = anim_cache.get_anim_img(f'{assets_folder}/{location_map[segment["location"]]}', resample=resample)
+    layers = [Layer(bg, shake=shake)]
+    if segment["character"] is not None:
+      talking_path, idle_path = asset_index.resolve(segment["character"], segment["emotion"])
+      character = anim_cache.get_anim_img(
+        talking_path if segment["sprite"] == "talking" else idle_path, half_speed=True, resample=resample
+      )
+      layers.append(Layer(character, shake=shake, repeat=segment.get("repeat", True)))
+    if segment["location"] == Location.COURTROOM_LEFT:
+      bench = anim_cache.get_anim_img(f"{assets_folder}/logo-left.png", resample=resample)
+      layers.append(Layer(bench, shake=shake))
+    elif segment["location"] == Location.COURTROOM_RIGHT:
+      bench = anim_cache.get_anim_img(f"{assets_folder}/logo-right.png", resample=resample)
+      layers.append(Layer(bench, shake=shake))
+    elif segment["location"] == Location.WITNESS_STAND:
+      bench = anim_cache.get_anim_img(f"{assets_folder}/witness_stand.png", w=bg.w, resample=resample)
+      layers.append(Layer(bench, shake=shake, y=bg.h - bench.h))
+    if segment.get("objection", False):
+      layers.append(Layer(objection, shake=True))
+    if segment["textbox"]:
+      textbox = anim_cache.get_anim_img(f"{assets_folder}/textbox4.png", w=bg.w, resample=resample)
+      name = anim_cache.get_anim_text(segment["name"], font_path=font_path, font_size=12, x=4, y=113)
+      text = anim_cache.get_dialogue_text(
+        segment["text"], font_path=font_path, font_size=15, x=5, y=130, colour=segment["colour"],
+      )
+      layers += [
+        Layer(textbox, shake=shake),
+        Layer(name),
+        Layer(text, typewriter=typewriter and segment["typewriter"]),
+      ]
+      if segment["arrow"]:
+        layers.append(Layer(arrow))
+    # frame_step > 1 samples the full-rate timeline, so scene boundaries never
+    # drift
+    yield AnimScene(
+      layers, segment["length"], start_frame=segment["anim_start"],
+      step=frame_step, offset=-segment["start"] % frame_step,
+    )
 
 
 def do_video(
-    config: List[Dict], assets_folder, fps, lag_frames=25,
-    cache_video_codec=None, cache_video_extension='avi', cache_folder='cache'
+    timeline: Timeline, assets_folder,
+    cache_video_codec=None, cache_video_extension='avi', cache_folder='cache',
+    asset_index: AssetIndex = None, frame_step=1, typewriter=True, resample=None, ring_depth=8, render_workers=None
 ):
-  scenes = []
-  sound_effects = []
-  for scene in tqdm(config, total=len(config), desc='creating video...'):
-    bg = anim_cache.get_anim_img(f'{assets_folder}/{location_map[scene["location"]]}')
-    arrow = anim_cache.get_anim_img(f"{assets_folder}/arrow.png", x=235, y=170, w=15, h=15, key_x=5)
-    textbox = anim_cache.get_anim_img(f"{assets_folder}/textbox4.png", w=bg.w)
-    objection = anim_cache.get_anim_img(f"{assets_folder}/objection.gif")
-    bench = None
-    if scene["location"] == Location.COURTROOM_LEFT:
-      bench = anim_cache.get_anim_img(f"{assets_folder}/logo-left.png")
-    elif scene["location"] == Location.COURTROOM_RIGHT:
-      bench = anim_cache.get_anim_img(f"{assets_folder}/logo-right.png")
-    elif scene["location"] == Location.WITNESS_STAND:
-      bench = anim_cache.get_anim_img(f"{assets_folder}/witness_stand.png", w=bg.w)
-      bench.y = bg.h - bench.h
-    if "audio" in scene:
-      sound_effects.append({"_type": "bg", "src": f'{assets_folder}/{scene["audio"]}.mp3'})
-    current_frame = 0
-    current_character_name = None
-    text = None
-    for obj in scene["scene"]:
-      if "character" in obj:
-        _dir = f'{assets_folder}/{character_map[obj["character"]]}'
-        current_character_name = str(obj["character"])
-        character_name = anim_cache.get_anim_text(
-          current_character_name,
-          font_path=f"{assets_folder}/igiari/Igiari.ttf",
-          font_size=12,
-          x=4,
-          y=113,
-        )
-        default = "normal" if "emotion" not in obj else obj["emotion"]
-        default_path = (
-          f"{_dir}/{current_character_name.lower()}-{default}(a).gif"
-        )
-        if not os.path.isfile(default_path):
-          default_path = (
-            f"{_dir}/{current_character_name.lower()}-{default}.gif"
-          )
-          assert os.path.isfile(
-            default_path
-          ), f"{default_path} does not exist"
-        default_character = anim_cache.get_anim_img(default_path, half_speed=True)
-        if "(a)" in default_path:
-          talking_character = anim_cache.get_anim_img(
-            default_path.replace("(a)", "(b)"), half_speed=True
-          )
-        else:
-          talking_character = anim_cache.get_anim_img(default_path, half_speed=True)
-      if "emotion" in obj:
-        default = obj["emotion"]
-        default_path = (
-          f"{_dir}/{current_character_name.lower()}-{default}(a).gif"
-        )
-        if not os.path.isfile(default_path):
-          default_path = (
-            f"{_dir}/{current_character_name.lower()}-{default}.gif"
-          )
-          assert os.path.isfile(
-            default_path
-          ), f"{default_path} does not exist"
-        default_character = anim_cache.get_anim_img(default_path, half_speed=True)
-        if "(a)" in default_path:
-          talking_character = anim_cache.get_anim_img(
-            default_path.replace("(a)", "(b)"), half_speed=True
-          )
-        else:
-          talking_character = anim_cache.get_anim_img(default_path, half_speed=True)
-      if "action" in obj and (
-        obj["action"] == Action.TEXT
-        or obj["action"] == Action.TEXT_SHAKE_EFFECT
-      ):
-        # TODO speed this up, too slow
-        character = talking_character
-        _text = split_str_into_newlines(obj["text"])
-        _colour = None if "colour" not in obj else obj["colour"]
-        text = anim_cache.get_anim_text(
-          _text,
-          font_path=f"{assets_folder}/igiari/Igiari.ttf",
-          font_size=15,
-          x=5,
-          y=130,
-          typewriter_effect=True,
-          colour=_colour,
-        )
-        num_frames = len(_text) + lag_frames
-        _character_name = character_name
-        if "name" in obj:
-          _character_name = anim_cache.get_anim_text(
-            obj["name"],
-            font_path=f"{assets_folder}/igiari/Igiari.ttf",
-            font_size=12,
-            x=4,
-            y=113,
-          )
-        if obj["action"] == Action.TEXT_SHAKE_EFFECT:
-          bg.shake_effect = True
-          character.shake_effect = True
-          if bench is not None:
-            bench.shake_effect = True
-          textbox.shake_effect = True
-        scene_objs = list(
-          filter(
-            lambda x: x is not None,
-            [bg, character, bench, textbox, _character_name, text],
-          )
-        )
-        scenes.append(
-          AnimScene(scene_objs, len(_text) - 1, start_frame=current_frame)
-        )
-        sound_effects.append({"_type": "bip", "length": len(_text) - 1})
-        if obj["action"] == Action.TEXT_SHAKE_EFFECT:
-          bg.shake_effect = False
-          character.shake_effect = False
-          if bench is not None:
-            bench.shake_effect = False
-          textbox.shake_effect = False
-        text.typewriter_effect = False
-        character = default_character
-        scene_objs = list(
-          filter(
-            lambda x: x is not None,
-            [bg, character, bench, textbox, _character_name, text, arrow],
-          )
-        )
-        scenes.append(
-          AnimScene(scene_objs, lag_frames, start_frame=len(_text) - 1)
-        )
-        current_frame += num_frames
-        sound_effects.append({"_type": "silence", "length": lag_frames})
-
-      elif "action" in obj and obj["action"] == Action.SHAKE_EFFECT:
-        bg.shake_effect = True
-        character.shake_effect = True
-        if bench is not None:
-          bench.shake_effect = True
-        textbox.shake_effect = True
-        character = default_character
-        #         print(character, textbox, character_name, text)
-        if text is not None:
-          scene_objs = list(
-            filter(
-              lambda x: x is not None,
-              [
-                bg,
-                character,
-                bench,
-                textbox,
-                character_name,
-                text,
-                arrow,
-              ],
-            )
-          )
-        else:
-          scene_objs = [bg, character, bench]
-        scenes.append(
-          AnimScene(scene_objs, lag_frames, start_frame=current_frame)
-        )
-        sound_effects.append({"_type": "shock", "length": lag_frames})
-        current_frame += lag_frames
-        bg.shake_effect = False
-        character.shake_effect = False
-        if bench is not None:
-          bench.shake_effect = False
-        textbox.shake_effect = False
-      elif "action" in obj and obj["action"] == Action.OBJECTION:
-        #         bg.shake_effect = True
-        #         character.shake_effect = True
-        #         if bench is not None:
-        #           bench.shake_effect = True
-        objection.shake_effect = True
-        character = default_character
-        scene_objs = list(
-          filter(lambda x: x is not None, [bg, character, bench, objection])
-        )
-        scenes.append(AnimScene(scene_objs, 11, start_frame=current_frame))
-        bg.shake_effect = False
-        if bench is not None:
-          bench.shake_effect = False
-        character.shake_effect = False
-        scene_objs = list(
-          filter(lambda x: x is not None, [bg, character, bench])
-        )
-        scenes.append(AnimScene(scene_objs, 11, start_frame=current_frame))
-        sound_effects.append(
-          {
-            "_type": "objection",
-            "character": current_character_name.lower(),
-            "length": 22,
-          }
-        )
-        current_frame += 11
-      else:
-        # list(filter(lambda x: x is not None, scene_objs))
-        character = default_character
-        scene_objs = list(
-          filter(lambda x: x is not None, [bg, character, bench])
-        )
-        _length = lag_frames
-        if "length" in obj:
-          _length = obj["length"]
-        if "repeat" in obj:
-          character.repeat = obj["repeat"]
-        scenes.append(AnimScene(scene_objs, _length, start_frame=current_frame))
-        character.repeat = True
-        sound_effects.append({"_type": "silence", "length": _length})
-        current_frame += _length
-  video = AnimVideo(scenes, fps=fps, extension=cache_video_extension, codec=cache_video_codec)
-  video.render(f"{cache_folder}/video.{cache_video_extension}")
-  return sound_effects
-
-
-def do_audio(sound_effects: List[Dict], assets_folder, fps, cache_folder='cache'):
-  audio_se = AudioSegment.empty()
-  bip = AudioSegment.from_wav(
-    f"{assets_folder}/sfx general/sfx-blipmale.wav"
-  ) + AudioSegment.silent(duration=50)
-  blink = AudioSegment.from_wav(f"{assets_folder}/sfx general/sfx-blink.wav")
-  blink -= 10
-  badum = AudioSegment.from_wav(f"{assets_folder}/sfx general/sfx-fwashing.wav")
-  long_bip = bip * 100
-  long_bip -= 10
-  spf = 1 / fps * 1000
-  pheonix_objection = AudioSegment.from_mp3(f"{assets_folder}/Phoenix - objection.mp3")
-  edgeworth_objection = AudioSegment.from_mp3(
-    f"{assets_folder}/Edgeworth - (English) objection.mp3"
+  scenes = iter_scenes(
+    timeline, assets_folder, asset_index=asset_index, frame_step=frame_step, typewriter=typewriter, resample=resample
+  )
+  video = AnimVideo(
+    scenes, fps=timeline.fps / frame_step, extension=cache_video_extension, codec=cache_video_codec,
+    ring_depth=ring_depth, render_workers=render_workers,
+  )
+  return video.render(f"{cache_folder}/video.{cache_video_extension}")
+
+
+def place_blips(mix: np.ndarray, timeline: Timeline, cue: Dict, blip: np.ndarray):
+  # The typewriter shows text[:i] on frame i of the segment, so character k
+  # appears on frame k + 1. Each non-space character gets one blip starting
+  # at the exact sample of that frame.
+  for k, char in enumerate(cue["text"]):
+    if char.isspace():
+      continue
+    start = timeline.frame_to_sample(cue["start"] + k + 1)
+    n = max(0, min(len(blip), len(mix) - start))
+    mix[start:start + n] += blip[:n]
+
+
+def mix_audio(timeline: Timeline, assets_folder):
+  # returns the soundtrack as interleaved 16-bit stereo PCM, shape (n, 2)
+  sample_rate = timeline.sample_rate
+  mix = np.zeros((timeline.total_samples, 2), dtype=np.int32)
+
+  def place(samples, cue):
+    start, end = timeline.sample_range(cue)
+    n = max(0, min(end - start, len(samples)))
+    mix[start:start + n] += samples[:n]
+
+  def load(path, gain=0):
+    return sound_cache.get_samples(path, sample_rate=sample_rate, gain=gain)
+
+  # blips are mixed at -10 dB, scaled once per voice
+  voices = {cue["voice"] for cue in timeline.audio if cue["_type"] == "bip"}
+  blips = {
+    voice: (load(f"{assets_folder}/{blip_voice_map[voice]}") * 10 ** (-10 / 20)).astype(np.int32) for voice in voices
+  }
+  blink = load(f"{assets_folder}/{sound_effect_map['blink']}", gain=sound_gains[sound_effect_map['blink']])
+  badum = load(f"{assets_folder}/{sound_effect_map['shock']}")
+  objections = {
+    character: load(f"{assets_folder}/{path}") for character, path in objection_audio_map.items()
+  }
+
+  for cue in tqdm(timeline.audio, total=len(timeline.audio), desc='creating sound effects...'):
+    if cue["_type"] == "bip":
+      place(blink, cue)
+      place_blips(mix, timeline, cue, blips[cue["voice"]])
+    elif cue["_type"] == "objection":
+      place(objections.get(cue["character"], objections["default"]), cue)
+    elif cue["_type"] == "shock":
+      place(badum, cue)
+    elif cue["_type"] == "music":
+      # TODO repeat music after ending
+      music = load(f'{assets_folder}/{cue["audio"]}.mp3')
+      place(music[timeline.frame_to_sample(cue["offset"]):], cue)
+  return np.clip(mix, -32768, 32767).astype(np.int16)
+
+
+def do_audio(timeline: Timeline, assets_folder, cache_folder='cache'):
+  pcm = mix_audio(timeline, assets_folder)
+  final_se = AudioSegment(
+    pcm.tobytes(),
+    frame_rate=timeline.sample_rate,
+    sample_width=2,
+    channels=2,
   )
-  default_objection = AudioSegment.from_mp3(f"{assets_folder}/Payne - Objection.mp3")
-
-  for obj in tqdm(sound_effects, total=len(sound_effects), desc='creating sound effects...'):
-    if obj["_type"] == "silence":
-      audio_se += AudioSegment.silent(duration=int(obj["length"] * spf))
-    elif obj["_type"] == "bip":
-      audio_se += blink + long_bip[: int(obj["length"] * spf - len(blink))]
-    elif obj["_type"] == "objection":
-      if obj["character"] == "phoenix":
-        audio_se += pheonix_objection[: int(obj["length"] * spf)]
-      elif obj["character"] == "edgeworth":
-        audio_se += edgeworth_objection[: int(obj["length"] * spf)]
-      else:
-        audio_se += default_objection[: int(obj["length"] * spf)]
-    elif obj["_type"] == "shock":
-      audio_se += badum[: int(obj["length"] * spf)]
-  #   audio_se -= 10
-  music_tracks = []
-  len_counter = 0
-  for obj in sound_effects:
-    if obj["_type"] == "bg":
-      if len(music_tracks) > 0:
-        music_tracks[-1]["length"] = len_counter
-        len_counter = 0
-      music_tracks.append({"src": obj["src"]})
-    else:
-      len_counter += obj["length"]
-  if len(music_tracks) > 0:
-    music_tracks[-1]["length"] = len_counter
-  #   print(music_tracks)
-  music_se = AudioSegment.empty()
-  # TODO repeat music after ending
-  for track in tqdm(music_tracks, total=len(music_tracks), desc='creating music...'):
-    music_se += AudioSegment.from_mp3(track["src"])[
-      : int((track["length"] / fps) * 1000)
-    ]
-  #   music_se = AudioSegment.from_mp3(sound_effects[0]["src"])[:len(audio_se)]
-  #   music_se -= 5
-  final_se = audio_se.overlay(music_se)
-  # final_se = audio_se
   final_se.export(f"{cache_folder}/audio.mp3", format="mp3")
+  return f"{cache_folder}/audio.mp3"
+
+
+def do_audio_track(timeline: Timeline, assets_folder, cache_folder='cache', audio_codec='aac', audio_handoff='pcm'):
+  # mixes and encodes the final audio stream, so the mux only has to copy it.
+  # "pcm" pipes the raw mix into the encoder; "mp3" goes through the old
+  # audio.mp3 export, which adds a lossy encode and decode.
+  track_path = f"{cache_folder}/audio.mka"
+  if os.path.exists(track_path):
+    os.remove(track_path)
+  if audio_handoff == 'pcm':
+    pcm = mix_audio(timeline, assets_folder)
+    ffmpeg.input('pipe:', format='s16le', ar=timeline.sample_rate, ac=2).output(
+      track_path, acodec=audio_codec, strict="experimental"
+    ).run(input=memoryview(pcm.reshape(-1).view(np.uint8)), capture_stdout=True, capture_stderr=True)
+  elif audio_handoff == 'mp3':
+    audio_path = do_audio(timeline, assets_folder, cache_folder=cache_folder)
+    ffmpeg.input(audio_path).output(
+      track_path, acodec=audio_codec, strict="experimental"
+    ).run(capture_stdout=True, capture_stderr=True)
+  else:
+    raise ValueError(f"audio_handoff must be 'pcm' or 'mp3', not {audio_handoff!r}")
+  return track_path
 
 
 def ace_attorney_animate(
@@ -312,31 +188,225 @@ def ace_attorney_animate(
     audio_codec='aac',
     cache_video_codec=cv2.VideoWriter_fourcc(*'MPEG'),
     cache_video_extension='avi',
-    cache_folder='cache'
+    cache_folder='cache',
+    prewarm_workers=8,
+    encoding_profile=None,
+    preview=False,
+    preview_fps=6,
+    lag_frames=25,
+    parallel_audio=True,
+    asset_index: AssetIndex = None,
+    output_options: Dict = None,
+    render_workers=None,
+    history_path=None,
+    record_history=True,
+    renditions: List[Dict] = None,
+    audio_handoff='pcm',
+    audio=True,
+    ring_depth=8,
 ):
+  # Frames are encoded in a separate process started with forkserver or
+  # spawn, which imports __main__: scripts calling this must guard their
+  # entry point with `if __name__ == '__main__':`.
+  start = time.perf_counter()
   if not os.path.exists(cache_folder):
-    os.mkdir(cache_folder)
+    os.makedirs(cache_folder)
+  if history_path is None:
+    history_path = render_history_path(cache_folder)
 
-  sound_effects = do_video(
-    config, assets_folder, fps,
-    cache_video_codec=cache_video_codec,
-    cache_video_extension=cache_video_extension,
-    cache_folder=cache_folder,
+  # preview renders every frame_step-th frame of the full-rate timeline with
+  # the typewriter skipped, so scene timing and the audio track are unchanged
+  frame_step = max(1, round(fps / preview_fps)) if preview else 1
+  resample = Image.NEAREST if preview else None
+  if encoding_profile is None:
+    encoding_profile = 'fast-preview' if preview else 'production'
+  if asset_index is None:
+    asset_index = AssetIndex.load(assets_folder, f"{cache_folder}/asset_index.json")
+  asset_index.validate(config)
+  timeline = build_timeline(config, fps, lag_frames=lag_frames)
+  if prewarm_workers > 0:
+    prewarm_assets(timeline, assets_folder, asset_index, workers=prewarm_workers, resample=resample)
+  # audio only depends on the timeline, so it is mixed and encoded on a
+  # worker while the frames are composited
+  with ThreadPoolExecutor(max_workers=1) as pool:
+    audio_future = None
+    if audio:
+      audio_future = pool.submit(
+        do_audio_track, timeline, assets_folder, cache_folder=cache_folder, audio_codec=audio_codec,
+        audio_handoff=audio_handoff,
+      )
+      if not parallel_audio:
+        audio_future.result()
+    video_path = do_video(
+      timeline, assets_folder,
+      cache_video_codec=cache_video_codec,
+      cache_video_extension=cache_video_extension,
+      cache_folder=cache_folder,
+      asset_index=asset_index,
+      frame_step=frame_step,
+      typewriter=not preview,
+      resample=resample,
+      ring_depth=ring_depth,
+      render_workers=render_workers,
+    )
+    audio_path = audio_future.result() if audio_future is not None else None
+  # all renditions come out of one ffmpeg run over the composited video
+  if renditions is None:
+    renditions = [{"output": output_filename}]
+  for rendition in renditions:
+    if os.path.exists(rendition["output"]):
+      os.remove(rendition["output"])
+  outputs = rendition_outputs(
+    ffmpeg.input(video_path).video,
+    ffmpeg.input(audio_path).audio if audio_path is not None else None,
+    renditions,
+    fps / frame_step,
+    video_codec=video_codec,
+    audio_codec='copy' if audio_path is not None else None,
+    profile=encoding_profile,
+    output_options=output_options,
   )
-  do_audio(sound_effects, assets_folder, fps)
-  video = ffmpeg.input(f"{cache_folder}/video.{cache_video_extension}")
-  audio = ffmpeg.input(f"{cache_folder}/audio.mp3")
+  ffmpeg.merge_outputs(*outputs).run(capture_stdout=True, capture_stderr=True)
+  # calibrates planning.plan_render's render time estimate; previews and
+  # multi-rendition encodes would skew its single-rendition average
+  if record_history and not preview and len(renditions) == 1:
+    record_render(
+      history_path, rendered_frame_count(timeline, frame_step), frame_size(timeline, assets_folder),
+      time.perf_counter() - start,
+    )
+  return timeline
+
+
+def write_hls_playlist(playlist_path, segment_paths: List[str], durations: List[float], complete=True):
+  lines = [
+    "#EXTM3U",
+    "#EXT-X-VERSION:3",
+    f"#EXT-X-TARGETDURATION:{math.ceil(max(durations, default=0))}",
+    "#EXT-X-MEDIA-SEQUENCE:0",
+    f"#EXT-X-PLAYLIST-TYPE:{'VOD' if complete else 'EVENT'}",
+  ]
+  playlist_folder = os.path.dirname(os.path.abspath(playlist_path))
+  for path, duration in zip(segment_paths, durations):
+    lines.append(f"#EXTINF:{duration:.3f},")
+    lines.append(os.path.relpath(os.path.abspath(path), playlist_folder).replace(os.sep, "/"))
+  if complete:
+    lines.append("#EXT-X-ENDLIST")
+  with open(playlist_path, "w") as f:
+    f.write("\n".join(lines) + "\n")
+
+
+def _render_chunk(*args, **kwargs):
+  # ffmpeg.Error can't be unpickled in the parent, which would only see a
+  # broken pool, so ffmpeg's own error output is passed back instead
+  try:
+    return ace_attorney_animate(*args, **kwargs)
+  except ffmpeg.Error as err:
+    raise RuntimeError(err.stderr.decode(errors="replace")) from None
+
+
+def ace_attorney_animate_chunked(
+    config: List[Dict],
+    output_filename: str = f"output.mp4",
+    assets_folder='assets',
+    fps=18,
+    segment_seconds=60,
+    segment_format='ts',
+    hls_playlist: str = None,
+    workers: int = None,
+    cache_folder='cache',
+    lag_frames=25,
+    audio_codec='aac',
+    audio_handoff='pcm',
+    audio=True,
+    asset_index: AssetIndex = None,
+    output_options: Dict = None,
+    **kwargs
+):
+  # Renders fixed-duration chunks of the scene list in separate processes.
+  # For a single output the chunks are video only and are joined with a
+  # stream copy under one soundtrack mixed from the whole timeline, so chunk
+  # boundaries can't shift audio against video. With hls_playlist set, each
+  # chunk carries its own audio cut to its video length and timestamps
+  # continuing from the previous chunk, and the playlist is updated as each
+  # chunk finishes, in order.
+  if segment_format not in ("ts", "mp4"):
+    raise ValueError(f"segment_format must be 'ts' or 'mp4', not {segment_format!r}")
+  if hls_playlist is not None and segment_format != "ts":
+    raise ValueError("HLS output needs MPEG-TS segments")
+  # the rest of kwargs goes to every chunk; these are decided per chunk here
+  if kwargs.pop("renditions", None) is not None:
+    raise ValueError("renditions are not supported for chunked output")
+  if kwargs.pop("history_path", None) is not None or kwargs.pop("record_history", False):
+    raise ValueError("chunked renders are not recorded in the render history")
+  if not os.path.exists(cache_folder):
+    os.makedirs(cache_folder)
+  if asset_index is None:
+    asset_index = AssetIndex.load(assets_folder, f"{cache_folder}/asset_index.json")
+  asset_index.validate(config)
+  chunks = split_config(config, fps, segment_seconds, lag_frames=lag_frames)
+  output_options = dict(output_options or {})
+  if segment_format == "mp4":
+    output_options["movflags"] = "frag_keyframe+empty_moov+default_base_moof"
+  if hls_playlist is not None:
+    segment_folder = os.path.dirname(os.path.abspath(hls_playlist))
+  else:
+    segment_folder = cache_folder
+  os.makedirs(segment_folder, exist_ok=True)
+  segment_paths = [f"{segment_folder}/segment_{idx:03d}.{segment_format}" for idx in range(len(chunks))]
+  durations = [chunk["frames"] / fps for chunk in chunks]
+
+  def chunk_options(chunk):
+    if hls_playlist is None:
+      return output_options
+    return dict(output_options, t=chunk["frames"] / fps, output_ts_offset=chunk["start"] / fps)
+
+  with ProcessPoolExecutor(max_workers=workers) as pool, ThreadPoolExecutor(max_workers=1) as audio_pool:
+    futures = [
+      pool.submit(
+        _render_chunk,
+        chunk["config"],
+        output_filename=segment_path,
+        assets_folder=assets_folder,
+        fps=fps,
+        cache_folder=f"{cache_folder}/segment_{idx:03d}",
+        lag_frames=lag_frames,
+        asset_index=asset_index,
+        output_options=chunk_options(chunk),
+        audio_codec=audio_codec,
+        audio_handoff=audio_handoff,
+        audio=audio and hls_playlist is not None,
+        # chunks run concurrently and aren't a single-pass timing
+        record_history=False,
+        **kwargs
+      )
+      for idx, (chunk, segment_path) in enumerate(zip(chunks, segment_paths))
+    ]
+    audio_future = None
+    if audio and hls_playlist is None:
+      audio_future = audio_pool.submit(
+        do_audio_track, build_timeline(config, fps, lag_frames=lag_frames), assets_folder,
+        cache_folder=cache_folder, audio_codec=audio_codec, audio_handoff=audio_handoff,
+      )
+    for idx, future in enumerate(futures):
+      future.result()
+      if hls_playlist is not None:
+        write_hls_playlist(
+          hls_playlist, segment_paths[:idx + 1], durations[:idx + 1], complete=idx == len(futures) - 1
+        )
+    audio_path = audio_future.result() if audio_future is not None else None
+  if hls_playlist is not None:
+    return hls_playlist
+  concat_list = f"{cache_folder}/segments.txt"
+  with open(concat_list, "w") as f:
+    for segment_path in segment_paths:
+      f.write(f"file '{os.path.abspath(segment_path)}'\n")
   if os.path.exists(output_filename):
     os.remove(output_filename)
-  out = ffmpeg.output(
-    video,
-    audio,
-    output_filename,
-    vcodec=video_codec,
-    acodec=audio_codec,
-    strict="experimental",
-  )
-  out.run(capture_stdout=True, capture_stderr=True)
+  streams = [ffmpeg.input(concat_list, format="concat", safe=0).video]
+  if audio_path is not None:
+    streams.append(ffmpeg.input(audio_path).audio)
+  ffmpeg.output(*streams, output_filename, c="copy").run(capture_stdout=True, capture_stderr=True)
+  return output_filename
 
 
 def get_characters(most_common: List):
@@ -371,8 +441,20 @@ def get_characters(most_common: List):
   return characters
 
 
-def comments_to_scene(comments: List, **kwargs):
-  nlp = spacy.load("en_core_web_sm")
+_nlp = None
+
+
+def get_nlp():
+  # loading the pipeline dominates short scripts, so it is shared across calls
+  global _nlp
+  if _nlp is None:
+    import spacy
+    _nlp = spacy.load("en_core_web_sm")
+  return _nlp
+
+
+def format_scenes(comments: List):
+  nlp = get_nlp()
   audio_min_scene_duration = 3
   scene = []
   for comment in comments:
@@ -474,4 +556,12 @@ def comments_to_scene(comments: List, **kwargs):
       audio_duration = 0
     audio_duration += 1
     formatted_scenes.append(formatted_scene)
-  ace_attorney_animate(formatted_scenes, **kwargs)
+  return formatted_scenes
+
+
+def comments_to_scene(comments: List, segment_seconds=None, **kwargs):
+  formatted_scenes = format_scenes(comments)
+  if segment_seconds is not None:
+    ace_attorney_animate_chunked(formatted_scenes, segment_seconds=segment_seconds, **kwargs)
+  else:
+    ace_attorney_animate(formatted_scenes, **kwargs)
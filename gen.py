@@ -1,7 +1,8 @@
+import emotion
 import engine
+import itertools
 import os
 
-from transformers import AutoTokenizer, AutoModelForSeq2SeqLM
 from tqdm import tqdm
 
 
@@ -19,30 +20,92 @@ class Author(object):
 		self.character = character
 
 
-if __name__ == '__main__':
-	data_path = 'D:\\Data\\A-Few-Good-Men\\truth.txt'
-	model_name = 'mrm8488/t5-base-finetuned-emotion'
-	os.environ["PATH"] += ';C:/Program Files/ffmpeg-4.3.1/bin/'
+class ScreenplayParser(object):
+	# Indentation-based screenplay: speaker names are indented 9 levels,
+	# parentheticals 7 and dialogue 6.
+	def __init__(self, authors, indent='    '):
+		self.c_map = {a.name: a for a in authors}
+		self.indent = indent
+
+	def parse(self, lines):
+		current_line = []
+		previous_character = None
+		for line in lines:
+			if line.startswith(self.indent * 9):
+				current_character = self.c_map[line.strip().lower().capitalize()]
+				if previous_character is not None and previous_character != current_character:
+					if len(current_line) > 0:
+						yield Comment(body=' '.join(current_line), author=previous_character)
+					current_line.clear()
+				previous_character = current_character
+			elif line.startswith(self.indent * 7):
+				pass
+			elif line.startswith(self.indent * 6):
+				line = line.strip()
+				if line != '':
+					current_line.append(line)
+		if previous_character is not None and len(current_line) > 0:
+			yield Comment(body=' '.join(current_line), author=previous_character)
+
+
+parsers = {
+	'screenplay': ScreenplayParser,
+}
 
-	tokenizer = AutoTokenizer.from_pretrained(model_name)
-	model = AutoModelForSeq2SeqLM.from_pretrained(model_name)
 
+class EmotionTagger(object):
+	# workers > 0 tags in a pool of processes sharing one model; keep the tagger
+	# around between videos so the pool is reused
+	def __init__(self, model_name=emotion.default_model, backend='generate', workers=None, threads=1, **kwargs):
+		if workers:
+			self.backend = emotion.TaggingPool(backend, model_name, workers=workers, threads=threads, **kwargs)
+		else:
+			self.backend = emotion.get_backend(backend, model_name, **kwargs)
 
-	def get_emotion(text):
-		input_ids = tokenizer.encode(
-			text + '</s>',
-			return_tensors='pt'
-		)
+	def tag(self, comments):
+		for comment, (label, score) in zip(comments, self.backend.predict([c.body for c in comments])):
+			comment.emotion = label
+			comment.score = score
+		return comments
 
-		output = model.generate(
-			input_ids=input_ids,
-			max_length=2
-		)
+	def close(self):
+		if isinstance(self.backend, emotion.TaggingPool):
+			self.backend.close()
 
-		dec = [tokenizer.decode(ids) for ids in output]
-		label = dec[0].replace('<pad>', '').strip()
-		return label
 
+def chunk_comments(comments, size):
+	comments = iter(comments)
+	while True:
+		window = list(itertools.islice(comments, size))
+		if len(window) == 0:
+			return
+		yield window
+
+
+def stream_scenes(lines, parser, tagger, window_size=10):
+	# lazily parses, tags and yields one window of comments at a time, so only
+	# a single window is ever held in memory
+	for window in chunk_comments(parser.parse(lines), window_size):
+		yield tagger.tag(window)
+
+
+def render_screenplay(
+		data_path, parser, tagger, output_pattern, window_size=10, max_windows=None, **kwargs
+):
+	output_filenames = []
+	with open(data_path) as f:
+		windows = stream_scenes(tqdm(f, desc='parsing script...'), parser, tagger, window_size=window_size)
+		for idx, window in enumerate(itertools.islice(windows, max_windows)):
+			output_filename = output_pattern.format(idx)
+			engine.comments_to_scene(window, output_filename=output_filename, **kwargs)
+			output_filenames.append(output_filename)
+	return output_filenames
+
+
+if __name__ == '__main__':
+	data_path = 'D:\\Data\\A-Few-Good-Men\\truth.txt'
+	model_name = emotion.default_model
+	os.environ["PATH"] += ';C:/Program Files/ffmpeg-4.3.1/bin/'
 
 	characters = [
 		Author(
@@ -63,37 +126,12 @@ if __name__ == '__main__':
 		),
 	]
 
-	c_map = {c.name: c for c in characters}
-	comments = []
-	current_line = []
-	current_character = None
-	previous_character = None
-	with open(data_path) as f:
-		lines = list(f)
-		for line in tqdm(lines):
-			if line.startswith('    ' * 9):
-				current_character = c_map[line.strip().lower().capitalize()]
-				if previous_character is not None and previous_character != current_character:
-					t = ' '.join(current_line)
-					comment = Comment(
-						body=t,
-						emotion=get_emotion(t),
-						author=previous_character
-					)
-					comments.append(comment)
-					current_line.clear()
-				previous_character = current_character
-			elif line.startswith('    ' * 7):
-				pass
-			elif line.startswith('    ' * 6):
-				line = line.strip()
-				if line != '':
-					current_line.append(line)
-
-	output_filename = 'output/Truth-debug-v1.mp4'
-	engine.comments_to_scene(
-			comments[:10],
-			output_filename=output_filename,
-			assets_folder='D:/Data/ace-attorney-reddit-bot-assets'
+	render_screenplay(
+		data_path,
+		parsers['screenplay'](characters),
+		EmotionTagger(model_name),
+		'output/Truth-debug-v1-{:03d}.mp4',
+		window_size=10,
+		max_windows=1,
+		assets_folder='D:/Data/ace-attorney-reddit-bot-assets'
 	)
-
@@ -0,0 +1,247 @@
+import argparse
+import hashlib
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+import numpy as np
+import PIL
+from PIL import Image, ImageDraw, ImageFont
+
+from script_constants import Location, Character, Action, location_map, character_map
+
+from assets import AssetIndex
+from engine import iter_scenes
+from timeline import build_timeline
+
+# Renders a fixed set of synthetic scene configs against procedurally generated
+# assets and compares every frame with the hashes stored in golden/frames.json,
+# so optimisations of AnimScene, AnimText and AnimImg can be checked for both
+# output and speed:
+#
+#   python golden.py check [--max-slowdown 1.5] [--save-frames out/]
+#   python golden.py update
+
+golden_path = "golden/frames.json"
+fps = 18
+lag_frames = 6
+
+golden_cases = {
+  "text_every_location": [
+    {"location": location, "scene": [{"character": character, "action": Action.TEXT, "text": "Hold it!"}]}
+    for location, character in [
+      (Location.COURTROOM_LEFT, Character.PHOENIX),
+      (Location.WITNESS_STAND, Character.LARRY),
+      (Location.COURTROOM_RIGHT, Character.EDGEWORTH),
+      (Location.CO_COUNCIL, Character.MAYA),
+      (Location.JUDGE_STAND, Character.JUDGE),
+      (Location.COURT_HOUSE, Character.PHOENIX),
+    ]
+  ],
+  "text_shake_effect": [
+    {"location": Location.COURTROOM_LEFT, "scene": [
+      {"character": Character.PHOENIX, "emotion": "handsondesk", "action": Action.TEXT_SHAKE_EFFECT,
+       "text": "Take that!"},
+    ]},
+    {"location": Location.WITNESS_STAND, "scene": [
+      {"character": Character.LARRY, "action": Action.TEXT_SHAKE_EFFECT, "text": "Whoa!"},
+    ]},
+  ],
+  "shake_effect": [
+    {"location": Location.COURTROOM_RIGHT, "scene": [
+      {"character": Character.EDGEWORTH, "action": Action.SHAKE_EFFECT},
+      {"action": Action.TEXT, "text": "Hmph."},
+      {"action": Action.SHAKE_EFFECT},
+    ]},
+  ],
+  "objection": [
+    {"location": Location.COURTROOM_LEFT, "scene": [
+      {"character": Character.PHOENIX, "action": Action.OBJECTION},
+      {"action": Action.TEXT, "text": "Objection!"},
+    ]},
+    {"location": Location.COURTROOM_RIGHT, "scene": [
+      {"character": Character.EDGEWORTH, "emotion": "emo", "action": Action.OBJECTION},
+    ]},
+  ],
+  "colour_text": [
+    {"location": Location.CO_COUNCIL, "scene": [
+      {"character": Character.MAYA, "emotion": "bench", "action": Action.TEXT, "text": "Nick, look!",
+       "colour": "#ff6060"},
+    ]},
+  ],
+  "name_override": [
+    {"location": Location.JUDGE_STAND, "scene": [
+      {"character": Character.JUDGE, "action": Action.TEXT, "text": "Order!", "name": "Randolph"},
+    ]},
+  ],
+  "idle_length_repeat": [
+    {"location": Location.COURTROOM_LEFT, "scene": [
+      {"character": Character.PHOENIX},
+      {"emotion": "handsondesk", "length": 9, "repeat": False},
+      {"length": 4},
+    ]},
+  ],
+}
+
+synthetic_sprites = {
+  # character: {emotion: has (a)/(b) talking variants}
+  Character.PHOENIX: {"normal": True, "handsondesk": True},
+  Character.EDGEWORTH: {"normal": False, "emo": True},
+  Character.LARRY: {"normal": True},
+  Character.MAYA: {"normal": False, "bench": True},
+  Character.JUDGE: {"normal": False},
+}
+
+
+def _gif(path, n_frames, colour, size=(96, 128), seed=0):
+  frames = []
+  for idx in range(n_frames):
+    frame = Image.new("P", size, 0)
+    frame.putpalette([0, 0, 0] + list(colour) + [255, 255, 255] + [0, 0, 0] * 253)
+    draw = ImageDraw.Draw(frame)
+    draw.rectangle((8 + seed % 7, 16, size[0] - 8, size[1] - 1), fill=1)
+    draw.ellipse((20 + idx * 4, 30, 40 + idx * 4, 50), fill=2)
+    frames.append(frame)
+  frames[0].save(path, save_all=True, append_images=frames[1:], transparency=0, disposal=2, loop=0)
+
+
+def _rgba(path, size, colour):
+  img = Image.new("RGBA", size, (0, 0, 0, 0))
+  ImageDraw.Draw(img).rectangle((1, 1, size[0] - 2, size[1] - 2), fill=colour)
+  img.save(path)
+
+
+def make_assets(folder, font_path=None):
+  os.makedirs(f"{folder}/igiari", exist_ok=True)
+  if font_path is None:
+    font = ImageFont.load_default(12)
+    if not hasattr(font, "font_bytes"):
+      raise RuntimeError("this Pillow has no built-in TrueType font, pass --font")
+    with open(f"{folder}/igiari/Igiari.ttf", "wb") as f:
+      f.write(font.font_bytes)
+  else:
+    with open(font_path, "rb") as src, open(f"{folder}/igiari/Igiari.ttf", "wb") as dst:
+      dst.write(src.read())
+  for idx, location in enumerate(Location):
+    bg = Image.new("RGB", (256, 192), (30 * idx, 90, 160 - 20 * idx))
+    ImageDraw.Draw(bg).line((0, 0, 255, 191), fill=(240, 240, 240), width=3)
+    bg.save(f"{folder}/{location_map[location]}")
+  _rgba(f"{folder}/arrow.png", (32, 32), (255, 255, 255, 255))
+  _rgba(f"{folder}/textbox4.png", (240, 64), (20, 20, 120, 255))
+  _rgba(f"{folder}/logo-left.png", (256, 48), (120, 80, 40, 255))
+  _rgba(f"{folder}/logo-right.png", (256, 48), (40, 80, 120, 255))
+  _rgba(f"{folder}/witness_stand.png", (200, 40), (140, 100, 60, 255))
+  _gif(f"{folder}/objection.gif", 5, (230, 30, 30), size=(256, 192))
+  for character, emotions in synthetic_sprites.items():
+    sprite_dir = f"{folder}/{character_map[character]}"
+    os.makedirs(sprite_dir, exist_ok=True)
+    for seed, (emotion, talking) in enumerate(emotions.items()):
+      prefix = f"{sprite_dir}/{str(character).lower()}-{emotion}"
+      colour = (40 + 15 * int(character), 200 - 10 * seed, 90)
+      if talking:
+        _gif(f"{prefix}(a).gif", 4, colour, seed=seed)
+        _gif(f"{prefix}(b).gif", 6, colour[::-1], seed=seed)
+      else:
+        _gif(f"{prefix}.gif", 3, colour, seed=seed)
+
+
+def average_hash(frame: Image, size=(32, 24)):
+  pixels = np.asarray(frame.convert("L").resize(size, Image.BILINEAR)).ravel()
+  bits = "".join("1" if p else "0" for p in pixels > pixels.mean())
+  return f"{int(bits, 2):0{len(bits) // 4}x}"
+
+
+def hash_distance(a: str, b: str):
+  return bin(int(a, 16) ^ int(b, 16)).count("1")
+
+
+def render_case(config, assets_folder, asset_index):
+  random.seed(0)
+  timeline = build_timeline(config, fps, lag_frames=lag_frames)
+  frames = []
+  images = []
+  start = time.perf_counter()
+  for scene in iter_scenes(timeline, assets_folder, asset_index=asset_index):
+    for frame in scene:
+      images.append(frame)
+  seconds = time.perf_counter() - start
+  for frame in images:
+    rgb = frame.convert("RGB")
+    frames.append({"sha1": hashlib.sha1(rgb.tobytes()).hexdigest(), "ahash": average_hash(rgb)})
+  return frames, images, seconds
+
+
+def render_all(font_path=None):
+  results = {}
+  with tempfile.TemporaryDirectory() as assets_folder:
+    make_assets(assets_folder, font_path=font_path)
+    asset_index = AssetIndex.scan(assets_folder)
+    for name, config in golden_cases.items():
+      results[name] = render_case(config, assets_folder, asset_index)
+  return results
+
+
+def update(font_path=None):
+  cases = {}
+  for name, (frames, _, seconds) in render_all(font_path).items():
+    cases[name] = {"frame_count": len(frames), "seconds": round(seconds, 4), "frames": frames}
+    print(f"{name:>20}: {len(frames):4d} frames  {seconds:7.3f}s")
+  os.makedirs(os.path.dirname(golden_path), exist_ok=True)
+  with open(golden_path, "w") as f:
+    json.dump({"pillow": PIL.__version__, "fps": fps, "cases": cases}, f, indent=1)
+
+
+def check(font_path=None, max_distance=16, max_slowdown=None, save_frames=None):
+  with open(golden_path) as f:
+    golden = json.load(f)
+  failed = False
+  for name, (frames, images, seconds) in render_all(font_path).items():
+    expected = golden["cases"].get(name)
+    if expected is None:
+      print(f"{name:>20}: no golden frames, run `python golden.py update`")
+      failed = True
+      continue
+    status = "exact"
+    if len(frames) != expected["frame_count"]:
+      status = f"FAIL frame count {len(frames)} != {expected['frame_count']}"
+    else:
+      bad = []
+      worst = 0
+      for idx, (frame, golden_frame) in enumerate(zip(frames, expected["frames"])):
+        if frame["sha1"] == golden_frame["sha1"]:
+          continue
+        distance = hash_distance(frame["ahash"], golden_frame["ahash"])
+        worst = max(worst, distance)
+        if distance > max_distance:
+          bad.append(idx)
+        if save_frames is not None:
+          os.makedirs(save_frames, exist_ok=True)
+          images[idx].save(f"{save_frames}/{name}-{idx:04d}.png")
+      if len(bad) > 0:
+        status = f"FAIL {len(bad)} frames differ, first {bad[:5]}"
+      elif worst > 0:
+        status = f"perceptual (max distance {worst})"
+    ratio = seconds / expected["seconds"] if expected["seconds"] > 0 else 1.0
+    if max_slowdown is not None and ratio > max_slowdown:
+      status += f", FAIL {ratio:.2f}x slower"
+    failed = failed or "FAIL" in status
+    print(f"{name:>20}: {seconds:7.3f}s (golden {expected['seconds']:7.3f}s, {ratio:5.2f}x)  {status}")
+  return not failed
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser()
+  parser.add_argument("command", choices=["check", "update"])
+  parser.add_argument("--font", default=None, help="TrueType font to use instead of Pillow's built-in one")
+  parser.add_argument("--max-distance", type=int, default=16, help="average-hash bits allowed to differ per frame")
+  parser.add_argument("--max-slowdown", type=float, default=None, help="fail cases slower than this ratio")
+  parser.add_argument("--save-frames", default=None, help="folder to write frames that differ from golden")
+  args = parser.parse_args()
+
+  if args.command == "update":
+    update(args.font)
+  elif not check(args.font, args.max_distance, args.max_slowdown, args.save_frames):
+    sys.exit(1)
@@ -0,0 +1,180 @@
+import json
+import os
+import threading
+import time
+import wave
+
+from typing import List, Dict
+
+from script_constants import location_map
+
+from animation import anim_cache
+from assets import AssetIndex, scene_assets
+from timeline import Timeline, build_timeline
+
+# used until the history file has measured renders to calibrate from
+default_seconds_per_megapixel_frame = 0.12
+history_window = 50
+# mp3 sizes are converted to decoded length assuming this bitrate
+assumed_mp3_bitrate = 128000
+
+
+class RenderTooLargeError(MemoryError):
+  def __init__(self, plan: Dict, memory_limit: int):
+    self.plan = plan
+    self.memory_limit = memory_limit
+    super().__init__(
+      f"render needs an estimated {plan['memory_bytes'] / 2 ** 20:.0f} MiB, "
+      f"over the {memory_limit / 2 ** 20:.0f} MiB limit"
+    )
+
+
+def _image_bytes(path, specs):
+  # decoded size of every cached AnimImg made from the image: GIF sprites
+  # are kept as one palette index per pixel, everything else as RGBA
+  img = anim_cache.get_image(path)
+  n_frames = getattr(img, "n_frames", 1)
+  per_pixel = 1 if img.format == "GIF" else 4
+  total = 0
+  for kwargs in specs:
+    w, h = kwargs.get("w"), kwargs.get("h")
+    if w is None and h is None:
+      w, h = img.size
+    elif h is None:
+      h = int(img.size[1] * w / img.size[0])
+    elif w is None:
+      w = int(img.size[0] * h / img.size[1])
+    total += w * h * n_frames * per_pixel
+  return total
+
+
+def _sound_bytes(path, sample_rate):
+  # sound_cache keeps the 16-bit AudioSegment and its int32 stereo samples
+  if path.endswith(".wav"):
+    with wave.open(path) as f:
+      seconds = f.getnframes() / f.getframerate()
+  else:
+    seconds = os.path.getsize(path) * 8 / assumed_mp3_bitrate
+  samples = int(seconds * sample_rate) * 2
+  return samples * 2 + samples * 4
+
+
+def render_history_path(cache_folder='cache'):
+  # where renders record their timings and plans read them back
+  return f"{cache_folder}/render_history"
+
+
+def _record_names(history_path):
+  # records are named by completion time, so sorting puts the newest last
+  return sorted(name for name in os.listdir(history_path) if name.endswith(".json"))
+
+
+def load_history(history_path):
+  if history_path is None or not os.path.isdir(history_path):
+    return []
+  history = []
+  for name in _record_names(history_path)[-history_window:]:
+    try:
+      with open(f"{history_path}/{name}") as f:
+        history.append(json.load(f))
+    except FileNotFoundError:
+      # pruned by a render finishing meanwhile
+      continue
+  return history
+
+
+def record_render(history_path, frames: int, frame_size, seconds: float):
+  # One file per render, written under a temporary name and moved into place,
+  # so renders finishing together never share a read-modify-write.
+  os.makedirs(history_path, exist_ok=True)
+  name = f"{time.time_ns():020d}-{os.getpid()}-{threading.get_ident()}"
+  with open(f"{history_path}/{name}.tmp", "w") as f:
+    json.dump({"frames": frames, "frame_size": list(frame_size), "seconds": seconds}, f)
+  os.replace(f"{history_path}/{name}.tmp", f"{history_path}/{name}.json")
+  for old in _record_names(history_path)[:-history_window]:
+    try:
+      os.remove(f"{history_path}/{old}")
+    except FileNotFoundError:
+      pass
+
+
+def seconds_per_megapixel_frame(history_path=None):
+  history = load_history(history_path)[-history_window:]
+  megapixel_frames = sum(r["frames"] * r["frame_size"][0] * r["frame_size"][1] / 1e6 for r in history)
+  if megapixel_frames == 0:
+    return default_seconds_per_megapixel_frame
+  return sum(r["seconds"] for r in history) / megapixel_frames
+
+
+def rendered_frame_count(timeline: Timeline, frame_step=1):
+  return sum(
+    len(range(-segment["start"] % frame_step, segment["length"], frame_step)) for segment in timeline.video
+  )
+
+
+def frame_size(timeline: Timeline, assets_folder):
+  # frames take the size of the first background
+  return anim_cache.get_image(f'{assets_folder}/{location_map[timeline.video[0]["location"]]}').size
+
+
+def plan_render(
+    config: List[Dict],
+    assets_folder='assets',
+    fps=18,
+    lag_frames=25,
+    preview=False,
+    preview_fps=6,
+    ring_depth=8,
+    asset_index: AssetIndex = None,
+    cache_folder='cache',
+    history_path=None,
+):
+  # Everything here comes from the config and asset file headers; nothing is
+  # rendered and no audio is decoded, so a queue can sort and admit jobs
+  # before any work starts.
+  # Raises MissingAssetsError like ace_attorney_animate would.
+  if asset_index is None:
+    asset_index = AssetIndex.scan(assets_folder)
+  if history_path is None:
+    history_path = render_history_path(cache_folder)
+  asset_index.validate(config)
+  timeline = build_timeline(config, fps, lag_frames=lag_frames)
+  frame_step = max(1, round(fps / preview_fps)) if preview else 1
+  rendered_frames = rendered_frame_count(timeline, frame_step)
+  assets = scene_assets(timeline, assets_folder, asset_index)
+  size = frame_size(timeline, assets_folder)
+  frame_bytes = size[0] * size[1] * 4
+  image_bytes = sum(_image_bytes(path, specs) for path, specs in assets["images"].items())
+  sound_bytes = sum(_sound_bytes(path, timeline.sample_rate) for path in assets["sounds"])
+  # the int32 mix plus its int16 copy for export
+  mix_bytes = timeline.total_samples * 2 * (4 + 2)
+  memory_bytes = image_bytes + sound_bytes + mix_bytes + frame_bytes * (ring_depth + 1)
+  megapixels = size[0] * size[1] / 1e6
+  return {
+    "frames": timeline.total_frames,
+    "rendered_frames": rendered_frames,
+    "duration": timeline.duration,
+    "frame_size": size,
+    "assets": assets,
+    "memory_bytes": memory_bytes,
+    "estimated_seconds": rendered_frames * megapixels * seconds_per_megapixel_frame(history_path),
+  }
+
+
+def schedule(jobs: List, memory_limit: int = None, key=lambda job: job):
+  # Shortest job first. key maps a job to its plan; jobs whose estimated
+  # memory is over memory_limit are returned separately as rejected.
+  accepted, rejected = [], []
+  for job in jobs:
+    plan = key(job)
+    if memory_limit is not None and plan["memory_bytes"] > memory_limit:
+      rejected.append(job)
+    else:
+      accepted.append(job)
+  accepted.sort(key=lambda job: key(job)["estimated_seconds"])
+  return accepted, rejected
+
+
+def check_memory(plan: Dict, memory_limit: int):
+  if plan["memory_bytes"] > memory_limit:
+    raise RenderTooLargeError(plan, memory_limit)
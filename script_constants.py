@@ -257,4 +257,28 @@ audio_emotions = {
   "anger": "11 - Pressing Pursuit _ Cornered , Variation",
   "fear": "10 - Suspense",
   "surprise": "05 - Logic and Trick",
-}
\ No newline at end of file
+}
+sound_effect_map = {
+  "blink": "sfx general/sfx-blink.wav",
+  "shock": "sfx general/sfx-fwashing.wav",
+}
+
+blip_voice_map = {
+  "male": "sfx general/sfx-blipmale.wav",
+  "female": "sfx general/sfx-blipfemale.wav",
+}
+
+# characters not listed here use the male blip
+character_voice_map = {
+  Character.FRANZISKA: "female",
+  Character.MAYA: "female",
+  Character.MAGGEY: "female",
+  Character.PEARL: "female",
+  Character.LOTTA: "female",
+}
+
+objection_audio_map = {
+  "phoenix": "Phoenix - objection.mp3",
+  "edgeworth": "Edgeworth - (English) objection.mp3",
+  "default": "Payne - Objection.mp3",
+}
@@ -0,0 +1,171 @@
+from fractions import Fraction
+from typing import List, Dict
+
+from script_constants import Action, character_voice_map
+
+
+def split_str_into_newlines(text: str, max_line_count: int = 34):
+  words = text.split(" ")
+  new_text = ""
+  for word in words:
+    last_sentence = new_text.split("\n")[-1] + word + " "
+    if len(last_sentence) >= max_line_count:
+      new_text += "\n" + word + " "
+    else:
+      new_text += word + " "
+  return new_text
+
+
+class Timeline:
+  # Every position is an absolute integer frame. Sample offsets are derived
+  # from the absolute frame each time, never accumulated, so rounding can't
+  # build up over a long video.
+  def __init__(self, fps, sample_rate: int = 44100):
+    self.fps = fps
+    self.sample_rate = sample_rate
+    self.video = []
+    self.audio = []
+    self.total_frames = 0
+    self._samples_per_frame = Fraction(sample_rate) / Fraction(fps)
+
+  def frame_to_sample(self, frame: int):
+    return int(frame * self._samples_per_frame)
+
+  @property
+  def total_samples(self):
+    return self.frame_to_sample(self.total_frames)
+
+  @property
+  def duration(self):
+    return self.total_frames / self.fps
+
+  def add_segment(self, length: int, **segment):
+    segment.update(start=self.total_frames, length=length)
+    self.video.append(segment)
+    self.total_frames += length
+    return segment
+
+  def add_cue(self, _type: str, start: int, length: int = None, **cue):
+    cue.update(_type=_type, start=start, length=length)
+    self.audio.append(cue)
+    return cue
+
+  def music_cues(self):
+    # a music cue plays until the next one starts or the video ends
+    cues = [cue for cue in self.audio if cue["_type"] == "music"]
+    for cue, next_cue in zip(cues, cues[1:] + [None]):
+      end = self.total_frames if next_cue is None else next_cue["start"]
+      cue["length"] = end - cue["start"]
+    return cues
+
+  def sample_range(self, cue: Dict):
+    return self.frame_to_sample(cue["start"]), self.frame_to_sample(cue["start"] + cue["length"])
+
+
+def build_timeline(config: List[Dict], fps, lag_frames=25, sample_rate=44100):
+  timeline = Timeline(fps, sample_rate=sample_rate)
+  character = None
+  emotion = "normal"
+  for scene_index, scene in enumerate(config):
+    location = scene["location"]
+    if "audio" in scene:
+      # audio_offset starts the track part-way through, for chunks cut mid-song
+      timeline.add_cue(
+        "music", timeline.total_frames, audio=scene["audio"], offset=scene.get("audio_offset", 0)
+      )
+    # anim_frame drives the sprite animation phase within a scene
+    anim_frame = 0
+    last_text = None
+    for obj in scene["scene"]:
+      if "character" in obj:
+        character = obj["character"]
+      if "character" in obj or "emotion" in obj:
+        emotion = obj.get("emotion", "normal")
+      base = {"location": location, "character": character, "emotion": emotion, "scene_index": scene_index}
+      action = obj.get("action")
+      if action == Action.TEXT or action == Action.TEXT_SHAKE_EFFECT:
+        text = split_str_into_newlines(obj["text"])
+        last_text = {
+          "text": text,
+          "colour": obj.get("colour"),
+          "name": obj.get("name", str(character)),
+        }
+        segment = timeline.add_segment(
+          len(text) - 1, **base, **last_text,
+          sprite="talking", textbox=True, typewriter=True, arrow=False,
+          shake=action == Action.TEXT_SHAKE_EFFECT, anim_start=anim_frame,
+        )
+        timeline.add_cue(
+          "bip", segment["start"], segment["length"], text=text, voice=character_voice_map.get(character, "male")
+        )
+        timeline.add_segment(
+          lag_frames, **base, **last_text,
+          sprite="idle", textbox=True, typewriter=False, arrow=True,
+          shake=False, anim_start=len(text) - 1,
+        )
+        anim_frame += len(text) + lag_frames
+      elif action == Action.SHAKE_EFFECT:
+        text_layers = {"textbox": False}
+        if last_text is not None:
+          text_layers = dict(last_text, name=str(character), textbox=True, typewriter=False, arrow=True)
+        segment = timeline.add_segment(
+          lag_frames, **base, **text_layers, sprite="idle", shake=True, anim_start=anim_frame,
+        )
+        timeline.add_cue("shock", segment["start"], segment["length"])
+        anim_frame += lag_frames
+      elif action == Action.OBJECTION:
+        segment = timeline.add_segment(
+          11, **base, sprite="idle", textbox=False, objection=True, anim_start=anim_frame,
+        )
+        timeline.add_segment(11, **base, sprite="idle", textbox=False, anim_start=anim_frame)
+        timeline.add_cue("objection", segment["start"], 22, character=str(character).lower())
+        anim_frame += 22
+      else:
+        _length = obj.get("length", lag_frames)
+        timeline.add_segment(
+          _length, **base, sprite="idle", textbox=False, repeat=obj.get("repeat", True), anim_start=anim_frame,
+        )
+        anim_frame += _length
+  timeline.music_cues()
+  return timeline
+
+
+def split_config(config: List[Dict], fps, segment_seconds, lag_frames=25):
+  # Cuts the scene list into chunks of at least segment_seconds, only at scenes
+  # that change location or music. Each chunk carries the character, emotion
+  # and music position it starts with, so it renders the same on its own.
+  timeline = build_timeline(config, fps, lag_frames=lag_frames)
+  scene_frames = [0] * len(config)
+  for segment in timeline.video:
+    scene_frames[segment["scene_index"]] += segment["length"]
+  target_frames = int(segment_seconds * fps)
+  chunks = []
+  current = None
+  character, emotion = None, "normal"
+  music, music_start = None, 0
+  frame = 0
+  for idx, scene in enumerate(config):
+    boundary = "audio" in scene or idx == 0 or scene["location"] != config[idx - 1]["location"]
+    if current is None or (current["frames"] >= target_frames and boundary):
+      scene = dict(scene, scene=[dict(obj) for obj in scene["scene"]])
+      if music is not None and "audio" not in scene:
+        scene["audio"] = music
+        scene["audio_offset"] = frame - music_start
+      if character is not None and len(scene["scene"]) > 0 and "character" not in scene["scene"][0]:
+        first = scene["scene"][0]
+        if "emotion" not in first:
+          first["emotion"] = emotion
+        first["character"] = character
+      current = {"config": [], "start": frame, "frames": 0}
+      chunks.append(current)
+    if "audio" in config[idx]:
+      music, music_start = config[idx]["audio"], frame - config[idx].get("audio_offset", 0)
+    for obj in config[idx]["scene"]:
+      if "character" in obj:
+        character = obj["character"]
+      if "character" in obj or "emotion" in obj:
+        emotion = obj.get("emotion", "normal")
+    current["config"].append(scene)
+    current["frames"] += scene_frames[idx]
+    frame += scene_frames[idx]
+  return chunks